@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012-2013 Lukasz Bolikowski
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import getopt
+import os
+import os.path
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import calcTags
+import makeCorpus
+import makeDB
+import makeFiles
+
+SCALES = [10000, 100000, 1000000]
+
+def run_makeDB(dirName):
+   conn = sqlite3.connect(os.path.join(dirName, 'dblp.sqlite'))
+   makeDB.create_tables(conn)
+   makeDB.tune(conn)
+   makeDB.parse_venues(conn, os.path.join(dirName, 'dblp_bht.xml'))
+   conn.commit()
+   makeDB.drop_indexes(conn)
+   state = makeDB.parse_records(conn, os.path.join(dirName, 'dblp.xml.gz'))
+   makeDB.create_indexes(conn)
+   conn.commit()
+   conn.close()
+   return state.get('stored', 0)
+
+def run_calcTags(dirName):
+   conn = sqlite3.connect(os.path.join(dirName, 'dblp.sqlite'))
+   calcTags.create_tables(conn)
+   calcTags.update_arxiv(conn, os.path.join(dirName, 'arXiv'))
+   calcTags.store_tags(conn, calcTags.calc_tags(conn))
+   count = conn.execute('SELECT COUNT(*) FROM arxiv').fetchone()[0]
+   conn.close()
+   return count
+
+def run_makeFiles(dirName):
+   feedsDirName = os.path.join(dirName, 'www')
+   for kind in ['conf', 'journals']:
+      if not os.path.isdir(os.path.join(feedsDirName, kind)):
+         os.makedirs(os.path.join(feedsDirName, kind))
+   conn = sqlite3.connect(os.path.join(dirName, 'dblp.sqlite'))
+   makeFiles.update_files(conn, feedsDirName, os.path.join(dirName, 'index.html.part'), os.path.join(dirName, 'index.json'))
+   count = conn.execute('SELECT COUNT(*) FROM feed').fetchone()[0]
+   conn.close()
+   return count
+
+# stage name, the function running it and what its items are; each stage
+# works on the output of the previous ones
+STAGES = [
+   ('makeDB', run_makeDB, 'records'),
+   ('calcTags', run_calcTags, 'arXiv'),
+   ('makeFiles', run_makeFiles, 'feeds'),
+]
+
+def run(stage, dirName):
+   """Runs a stage on the corpus in dirName and reports the results."""
+
+   function = dict((name, function) for name, function, items in STAGES)[stage]
+   start = time.time()
+   count = function(dirName)
+   elapsed = time.time() - start
+   rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   print '%d %f %d' % (count, elapsed, rss)
+
+def bench(scales, keep = None):
+   """Generates a corpus of every size in scales, and runs the pipeline
+   stages on it, each in a fresh process so that peak RSS is its own."""
+
+   print '%-10s %-10s %10s %-8s %10s %12s %12s' % ('documents', 'stage', 'items', '', 'seconds', 'items/s', 'peak RSS kB')
+   for size in scales:
+      dirName = tempfile.mkdtemp(dir = keep)
+      try:
+         makeCorpus.make_corpus(dirName, size)
+         for stage, function, items in STAGES:
+            output = subprocess.check_output([sys.executable, __file__, '--run', stage, dirName])
+            count, elapsed, rss = output.split()[-3:]
+            count, elapsed, rss = int(count), float(elapsed), int(rss)
+            print '%-10d %-10s %10d %-8s %10.2f %12.0f %12d' % (size, stage, count, items, elapsed, count / max(elapsed, 1e-6), rss)
+            sys.stdout.flush()
+      finally:
+         if keep == None:
+            shutil.rmtree(dirName)
+
+if __name__ == "__main__":
+   def usage():
+      print 'Usage: %s [-k <dir>] [<documents>...]' % sys.argv[0]
+      print '  -k  keep the generated corpora and outputs in this directory'
+      print '  default sizes: %s' % ' '.join(str(size) for size in SCALES)
+
+   if len(sys.argv) == 4 and sys.argv[1] == '--run':
+      run(sys.argv[2], sys.argv[3])
+      sys.exit(0)
+   try:
+      opts, args = getopt.getopt(sys.argv[1:], 'k:')
+   except getopt.GetoptError:
+      usage()
+      sys.exit(1)
+   opts = dict(opts)
+   bench([int(arg) for arg in args] or SCALES, opts.get('-k'))
+
+# vim:et:sw=3:ts=3
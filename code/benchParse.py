@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012-2013 Lukasz Bolikowski
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import gzip
+import os
+import os.path
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import makeCorpus
+import makeDB
+
+@makeDB.coroutine
+def count_records(state):
+   """Counts the records it receives, and keeps none of them."""
+
+   while True:
+      (yield)
+      state['kept'] = state.get('kept', 0) + 1
+
+def run(parser, dirName):
+   """Extracts and filters the records of the dump with the given backend,
+   without storing them, and reports the results."""
+
+   state = {}
+   start = time.time()
+   handle = gzip.open(os.path.join(dirName, 'dblp.xml.gz'), 'r')
+   makeDB.parse_stream(makeDB.filters(count_records(state), {}), handle, parser)
+   handle.close()
+   elapsed = time.time() - start
+   rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   print '%d %f %d' % (state.get('kept', 0), elapsed, rss)
+
+def run_insert(dirName):
+   """Stores the records of the dump in an in-memory database, timing only
+   the storing, which is the same whatever the parser."""
+
+   records = []
+   handle = gzip.open(os.path.join(dirName, 'dblp.xml.gz'), 'r')
+   makeDB.parse_stream(makeDB.filters(makeDB.collect(records), {}), handle, 'sax')
+   handle.close()
+   conn = sqlite3.connect(':memory:')
+   makeDB.create_tables(conn)
+   makeDB.drop_indexes(conn)
+   state = {}
+   start = time.time()
+   target = makeDB.store(conn, state)
+   for record in records:
+      target.send(record)
+   target.close()
+   conn.commit()
+   print '%d %f' % (state.get('stored', 0), time.time() - start)
+
+def bench(size):
+   dirName = tempfile.mkdtemp()
+   try:
+      makeCorpus.make_dump(dirName, size)
+      print '%d documents, %d bytes compressed' % (size, os.path.getsize(os.path.join(dirName, 'dblp.xml.gz')))
+      print '%-6s %10s %10s %12s %12s' % ('parser', 'records', 'seconds', 'docs/s', 'peak RSS kB')
+      for parser in makeDB.PARSERS:
+         # a fresh process per backend, so that peak RSS is not shared
+         output = subprocess.check_output([sys.executable, __file__, '--run', parser, dirName])
+         count, elapsed, rss = output.split()
+         count, elapsed, rss = int(count), float(elapsed), int(rss)
+         print '%-6s %10d %10.2f %12.0f %12d' % (parser, count, elapsed, size / elapsed, rss)
+      output = subprocess.check_output([sys.executable, __file__, '--insert', dirName])
+      count, elapsed = output.split()
+      count, elapsed = int(count), float(elapsed)
+      print 'storing %d records takes a further %.2f s (%.0f records/s), whatever the parser' % (count, elapsed, count / elapsed)
+   finally:
+      shutil.rmtree(dirName)
+
+if __name__ == "__main__":
+   if len(sys.argv) == 4 and sys.argv[1] == '--run':
+      run(sys.argv[2], sys.argv[3])
+      sys.exit(0)
+   if len(sys.argv) == 3 and sys.argv[1] == '--insert':
+      run_insert(sys.argv[2])
+      sys.exit(0)
+   if len(sys.argv) < 2:
+      print 'Usage: %s <documents>' % sys.argv[0]
+      sys.exit(1)
+   bench(int(sys.argv[1]))
+
+# vim:et:sw=3:ts=3
@@ -24,78 +24,335 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from lxml import etree
+from cStringIO import StringIO
+import getopt
+import collections
+import hashlib
+import itertools
+import multiprocessing
 import os
 import os.path
 import re
 import sqlite3
 import sys
+import time
 
-def parse_chunk(conn, chunk):
-   doc = etree.fromstring(chunk)
-   items = doc.xpath("//*[local-name() = 'arXiv']")
-   for item in items:
-      title = re.sub('\W+', ' ', item.xpath("./*[local-name() = 'title']")[0].text).strip()
-      raw_categories = item.xpath("./*[local-name() = 'categories']")[0].text.strip().split(' ')
+import chunkPack
+import metrics
+from makeDB import title_key
+
+ARXIV_NS = {'arXiv': 'http://arxiv.org/OAI/arXiv/'}
+ARXIV_TAG = '{%s}arXiv' % ARXIV_NS['arXiv']
+TITLE = etree.XPath('arXiv:title/text()', namespaces = ARXIV_NS, smart_strings = False)
+CATEGORIES = etree.XPath('arXiv:categories/text()', namespaces = ARXIV_NS, smart_strings = False)
+
+COMMIT_ROWS = 100000
+# a venue gets a tag if more than MIN_COUNT of its papers, and more than
+# MIN_FRACTION of the matches of its papers, are in that category
+MIN_COUNT = 4
+MIN_FRACTION = 0.3
+
+def parse_chunk(chunk):
+   """Extracts (title, categories, norm) rows from a harvested chunk, keeping
+   only the cs.* categories.  norm is the title_key of the title."""
+
+   rows = []
+   for _, item in etree.iterparse(StringIO(chunk), tag = ARXIV_TAG):
+      title = re.sub('\W+', ' ', TITLE(item)[0]).strip()
+      raw_categories = CATEGORIES(item)[0].strip().split(' ')
       categories = []
       for raw_category in raw_categories:
          if not raw_category.startswith('cs.'):
             continue
-         categories += [raw_category]
+         categories.append(raw_category)
       categories = ' '.join(categories)
-      conn.execute('INSERT INTO arxiv VALUES (?, ?)', (title, categories))
-   conn.commit()
+      rows.append((title, categories, title_key(title)))
+      item.clear()
+   return rows
+
+def read_chunk(source):
+   """Reads the raw bytes of a chunk: a file name, or a (pack, offset,
+   length) triple for a chunk in a pack."""
+
+   if isinstance(source, tuple):
+      base, offset, length = source
+      return chunkPack.ChunkPack(base).read(offset, length)
+   handle = open(source, 'rb')
+   raw = handle.read()
+   handle.close()
+   return raw
+
+def read_chunks(chunks):
+   """Yields (name, raw bytes, whether gzipped) for the given (name, source,
+   size, mtime) chunks, in order.  The chunks of a pack come one after
+   another in pack order (see chunks_from_disk), and are read in a single
+   pass over it."""
+
+   for base, group in itertools.groupby(chunks, lambda chunk: isinstance(chunk[1], tuple) and chunk[1][0]):
+      group = list(group)
+      if base:
+         segments = chunkPack.ChunkPack(base).segments(source[1:] for _, source, _, _ in group)
+         for (name, _, _, _), raw in itertools.izip(group, segments):
+            yield name, raw, True
+      else:
+         for name, source, _, _ in group:
+            yield name, read_chunk(source), source.endswith('.gz')
+
+def parse_chunk_file(task):
+   name, raw, compressed = task
+   chunk = raw
+   if compressed:
+      chunk = chunkPack.decompress(raw)
+   return name, hashlib.md5(raw).hexdigest(), parse_chunk(chunk)
+
+def parse_in_pool(pool, tasks, jobs):
+   """Parses the chunks in the pool, yielding the results in order.  The
+   tasks carry the chunks themselves, so only a few are in flight at a
+   time."""
+
+   pending = collections.deque()
+   for task in tasks:
+      pending.append(pool.apply_async(parse_chunk_file, (task,)))
+      if len(pending) >= 2 * jobs:
+         yield pending.popleft().get()
+   while pending:
+      yield pending.popleft().get()
 
 def chunks_from_disk(chunks_dir):
+   """Yields (name, source, size, mtime) for every chunk under chunks_dir,
+   whether a file or a part of a pack.  A chunk in a pack only changes if
+   the pack was truncated and appended to again, which renews its stamp,
+   so the stamp stands in for the mtime."""
+
    for root, dirs, files in os.walk(chunks_dir):
-       for name in files:
-          if not name.endswith('.xml'):
+       for name in sorted(files):
+          path = os.path.join(root, name)
+          if name.endswith(chunkPack.INDEX):
+             base = path[:-len(chunkPack.INDEX)]
+             pack = chunkPack.ChunkPack(base)
+             stamp = pack.stamp()
+             for counter, offset, length in pack.entries():
+                yield '%s#%08x' % (os.path.relpath(base, chunks_dir), counter), (base, offset, length), length, stamp
              continue
-          handle = open(os.path.join(root, name), 'r')
-          chunk = handle.read()
-          handle.close()
-          yield chunk
-
-def calc_tags(conn):
-   lookup = {}
-   for t, c in conn.execute('SELECT * FROM arxiv'):
-      h = re.sub('[^a-z0-9]', '', t.lower())
-      lookup[h] = c
-
-   tag_count = {}
-   venue_total = {}
-   for t, _, _, _, v, _ in conn.execute('SELECT * FROM record'):
-      h = re.sub('[^a-z0-9]', '', t.lower())
-      if h not in lookup:
+          if not name.endswith('.xml') and not name.endswith('.xml.gz'):
+             continue
+          stat = os.stat(path)
+          yield os.path.relpath(path, chunks_dir), path, stat.st_size, stat.st_mtime
+
+def scan_chunks(conn, chunks_dir):
+   """Compares the chunks on disk with the manifest.  Returns the new or
+   changed chunks as (name, source, size, mtime) tuples, and the names of
+   the chunks that are gone.  A chunk whose mtime changed but whose content
+   did not, e.g. because it was harvested again, is not reported."""
+
+   known = dict((name, (size, mtime, digest))
+      for name, size, mtime, digest in conn.execute('SELECT name, size, mtime, digest FROM chunk'))
+   changed = []
+   for name, source, size, mtime in chunks_from_disk(chunks_dir):
+      knownSize, knownMtime, digest = known.pop(name, (None, None, None))
+      if size == knownSize and mtime == knownMtime:
+         continue
+      if size == knownSize and digest == hashlib.md5(read_chunk(source)).hexdigest():
+         conn.execute('UPDATE chunk SET mtime = ? WHERE name = ?', (mtime, name))
          continue
-      for c in lookup[h].split(' '):
-         tag_count[(v, c)] = tag_count.get((v, c), 0) + 1
-         venue_total[v] = venue_total.get(v, 0) + 1
-
-   tags = []
-   for v, c in tag_count:
-      count = tag_count[(v, c)]
-      fraction = 1.0 * count / venue_total[v]
-      if count > 4 and fraction > 0.3:
-         tags += [(v, c)]
-   return tags
+      changed.append((name, source, size, mtime))
+   conn.commit()
+   return changed, known.keys()
+
+def load_chunks(conn, chunks, jobs = 1, state = None):
+   """Parses the given chunks, in a pool of processes if jobs > 1, and
+   inserts the results from this process, committing every COMMIT_ROWS rows.
+   The chunks are read here, and only their parsing is left to the pool.
+   Returns the manifest entries of the chunks.  With state given, the bytes
+   and rows read are added to it ('bytes' and 'rows')."""
+
+   if state is None:
+      state = {}
+   info = dict((name, (size, mtime)) for name, _, size, mtime in chunks)
+   tasks = read_chunks(chunks)
+   if jobs > 1:
+      pool = multiprocessing.Pool(jobs)
+      results = parse_in_pool(pool, tasks, jobs)
+   else:
+      results = itertools.imap(parse_chunk_file, tasks)
+
+   manifest = []
+   pending = 0
+   for name, digest, rows in results:
+      conn.executemany('INSERT INTO arxiv VALUES (?, ?, ?, ?)', [row + (name,) for row in rows])
+      size, mtime = info[name]
+      manifest.append((name, size, mtime, digest))
+      pending += len(rows)
+      state['bytes'] = state.get('bytes', 0) + size
+      state['rows'] = state.get('rows', 0) + len(rows)
+      if pending >= COMMIT_ROWS:
+         conn.commit()
+         pending = 0
+   conn.commit()
+
+   if jobs > 1:
+      pool.close()
+      pool.join()
+   return manifest
+
+def count_matches(conn, sign, affected = False, until = None):
+   """Matches DBLP records with arXiv papers on normalized titles and adds
+   the matches, times sign, to the per venue and category counts.  With
+   affected set, only titles listed in the affected table are matched; with
+   until given, only arXiv rows up to that rowid are considered.  When an
+   arXiv title occurs more than once, the paper from the latest chunk wins."""
+
+   where = ['1']
+   if affected:
+      where.append('norm IN (SELECT norm FROM affected)')
+   if until is not None:
+      where.append('rowid <= %d' % until)
+   counts = {}
+   for v, cs, n in conn.execute('SELECT v.key, a.categories, COUNT(*) FROM record AS r JOIN venue AS v ON v.id = r.venue JOIN (SELECT norm, categories FROM (SELECT norm, categories, ROW_NUMBER() OVER (PARTITION BY norm ORDER BY chunk DESC, rowid DESC) AS pos FROM arxiv WHERE %s) WHERE pos = 1) AS a ON a.norm = r.norm GROUP BY r.venue, a.categories' % ' AND '.join(where)):
+      for c in cs.split(' '):
+         counts[(v, c)] = counts.get((v, c), 0) + n
+   for (v, c), n in counts.iteritems():
+      conn.execute('INSERT OR IGNORE INTO tagcount VALUES (?, ?, 0)', (v, c))
+      conn.execute('UPDATE tagcount SET count = count + ? WHERE venue = ? AND category = ?', (sign * n, v, c))
+
+def update_arxiv(conn, chunks_dir, jobs = 1):
+   """Brings the arxiv table and the tag counts up to date with the chunks on
+   disk.  Only new or changed chunks are parsed.  The counts are adjusted
+   for the titles in those chunks, unless makeDB changed any DBLP records
+   since they were last computed (see makeDB.bump_build), in which case
+   they are recomputed in full.
+
+   The manifest is only updated in the final transaction, so after a crash
+   the same chunks are picked up again and their partial rows replaced.
+
+   Returns a dict with the numbers of chunks changed and removed ('changed'
+   and 'removed'), and the bytes and rows read from them ('bytes' and
+   'rows')."""
+
+   changed, removed = scan_chunks(conn, chunks_dir)
+   state = {'changed': len(changed), 'removed': len(removed)}
+   dropped = removed + [name for name, _, _, _ in changed]
+   build = conn.execute('SELECT value FROM meta WHERE name = ?', ('build',)).fetchone()
+   counted = conn.execute('SELECT value FROM meta WHERE name = ?', ('tags_build',)).fetchone()
+   incremental = counted is not None and counted == build
+
+   # counts are only trusted again once this update has finished
+   conn.execute('DELETE FROM meta WHERE name IN (?, ?)', ('tags_build', 'tags_mdate'))
+   conn.commit()
+
+   # rows up to here are the state the current counts were computed from
+   last = conn.execute('SELECT MAX(rowid) FROM arxiv').fetchone()[0] or 0
+   manifest = load_chunks(conn, changed, jobs, state)
+
+   if incremental:
+      conn.execute('DELETE FROM affected')
+      for name in dropped:
+         conn.execute('INSERT OR IGNORE INTO affected SELECT norm FROM arxiv WHERE chunk = ?', (name,))
+      count_matches(conn, -1, True, last)
+   for name in dropped:
+      conn.execute('DELETE FROM arxiv WHERE chunk = ? AND rowid <= ?', (name, last))
+      conn.execute('DELETE FROM chunk WHERE name = ?', (name,))
+   conn.executemany('INSERT INTO chunk VALUES (?, ?, ?, ?)', manifest)
+   if incremental:
+      count_matches(conn, 1, True)
+   else:
+      conn.execute('DELETE FROM tagcount')
+      count_matches(conn, 1)
+   conn.execute('DELETE FROM tagcount WHERE count = 0')
+   if build:
+      conn.execute('INSERT INTO meta VALUES (?, ?)', ('tags_build', build[0]))
+   conn.commit()
+   return state
+
+def calc_tags(conn, minCount = MIN_COUNT, minFraction = MIN_FRACTION):
+   """Picks the tags of venues from the stored counts, in one query.  It
+   does not touch the arXiv data, so it takes well under a second whatever
+   the thresholds."""
+
+   return conn.execute('SELECT t.venue, t.category FROM tagcount AS t JOIN (SELECT venue, SUM(count) AS total FROM tagcount GROUP BY venue) AS v ON v.venue = t.venue WHERE t.count > ? AND 1.0 * t.count / v.total > ?', (minCount, minFraction)).fetchall()
+
+def tag_stats(conn, minCounts, minFractions):
+   """Yields (min count, min fraction, tags, tagged venues) for every
+   combination of thresholds, to help choose them."""
+
+   for minCount in minCounts:
+      for minFraction in minFractions:
+         tags = calc_tags(conn, minCount, minFraction)
+         yield minCount, minFraction, len(tags), len(set(v for v, c in tags))
 
 def store_tags(conn, tags):
-   conn.execute('CREATE TABLE tags (venue TEXT, tag TEXT)')
-   for venue, tag in tags:
-      conn.execute('INSERT INTO tags VALUES (?, ?)', (venue, tag))
+   """Replaces the contents of the tags table in a single transaction."""
+
+   conn.execute('DELETE FROM tags')
+   conn.executemany('INSERT INTO tags VALUES (?, ?)', tags)
    conn.commit()
 
+def create_tables(conn):
+   conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+   columns = dict((row[1], row[2]) for row in conn.execute('PRAGMA table_info(arxiv)'))
+   if columns and columns.get('norm') <> 'INTEGER':
+      # rebuilt from scratch on every run before the manifest was kept, and
+      # matched on the text of normalized titles before they were hashed
+      conn.execute('DROP TABLE arxiv')
+      conn.execute('DROP TABLE IF EXISTS chunk')
+      conn.execute('DELETE FROM meta WHERE name = ?', ('tags_build',))
+      conn.commit()
+      conn.execute('VACUUM')
+   conn.execute('CREATE TABLE IF NOT EXISTS arxiv (title TEXT, categories TEXT, norm INTEGER, chunk TEXT)')
+   conn.execute('CREATE INDEX IF NOT EXISTS arxivbynorm ON arxiv (norm, chunk)')
+   conn.execute('CREATE INDEX IF NOT EXISTS arxivbychunk ON arxiv (chunk)')
+   conn.execute('CREATE TABLE IF NOT EXISTS chunk (name TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT)')
+   conn.execute('CREATE TABLE IF NOT EXISTS tagcount (venue TEXT, category TEXT, count INTEGER, PRIMARY KEY (venue, category))')
+   conn.execute('CREATE TABLE IF NOT EXISTS tags (venue TEXT, tag TEXT)')
+   conn.execute('CREATE TEMP TABLE IF NOT EXISTS affected (norm INTEGER PRIMARY KEY)')
+
 if __name__ == '__main__':
-   if len(sys.argv) < 3:
-      print >> sys.stderr, 'Usage: %s <db_filename> <chunks_dir>' % sys.argv[0]
+   opts = {}
+   try:
+      opts, args = getopt.getopt(sys.argv[1:], 'j:c:f:tnm:')
+      opts = dict(opts)
+      minCounts = [int(value) for value in opts.get('-c', str(MIN_COUNT)).split(',')]
+      minFractions = [float(value) for value in opts.get('-f', str(MIN_FRACTION)).split(',')]
+   except (getopt.GetoptError, ValueError):
+      args = []
+   if len(args) < 2 - ('-t' in opts):
+      print >> sys.stderr, 'Usage: %s [-j <jobs>] [-c <counts>] [-f <fractions>] [-t] [-n] [-m <metrics.prom>] <db_filename> [<chunks_dir>]' % sys.argv[0]
+      print >> sys.stderr, '  -j  number of parser processes (default: 1)'
+      print >> sys.stderr, '  -c  a venue needs more than this many papers in a category (default: %d)' % MIN_COUNT
+      print >> sys.stderr, '  -f  ... and more than this fraction of its matched papers (default: %s)' % MIN_FRACTION
+      print >> sys.stderr, '      several comma-separated values print the results of every combination'
+      print >> sys.stderr, '  -t  only apply the thresholds to the stored counts, without reading <chunks_dir>'
+      print >> sys.stderr, '  -n  print how many tags the thresholds give, without storing them'
+      print >> sys.stderr, '  -m  write metrics to this file, in the Prometheus text format'
       sys.exit(1)
-   db_filename, chunks_dir = sys.argv[1], sys.argv[2]
+   db_filename = args[0]
+   jobs = int(opts.get('-j', 1))
 
+   stats = metrics.Metrics('calcTags')
    conn = sqlite3.connect(db_filename)
-   conn.execute('CREATE TABLE arxiv (title TEXT, categories TEXT)')
-   chunks = chunks_from_disk(chunks_dir)
-   for chunk in chunks:
-      parse_chunk(conn, chunk)
-   tags = calc_tags(conn)
-   store_tags(conn, tags)
+   create_tables(conn)
+   if '-t' not in opts:
+      start = time.time()
+      state = update_arxiv(conn, args[1], jobs)
+      stats.since('arxiv', start)
+      stats.set('records_seen', state.get('rows', 0), source = 'arxiv')
+      stats.set('bytes_read', state.get('bytes', 0), file = 'chunks')
+      stats.set('rows_written', state.get('rows', 0), table = 'arxiv')
+      stats.set('chunks', state['changed'], state = 'changed')
+      stats.set('chunks', state['removed'], state = 'removed')
+      stats.set('chunks', conn.execute('SELECT COUNT(*) FROM chunk').fetchone()[0] - state['changed'], state = 'unchanged')
+   if '-n' in opts or len(minCounts) * len(minFractions) > 1:
+      print '%10s %10s %10s %10s' % ('count >', 'fraction >', 'tags', 'venues')
+      for row in tag_stats(conn, minCounts, minFractions):
+         print '%10d %10.2f %10d %10d' % row
+   else:
+      start = time.time()
+      tags = calc_tags(conn, minCounts[0], minFractions[0])
+      store_tags(conn, tags)
+      stats.since('tags', start)
+      stats.set('rows_written', len(tags), table = 'tags')
+   if '-m' in opts:
+      for table in ['arxiv', 'chunk', 'tagcount', 'tags']:
+         stats.set('rows', conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0], table = table)
+      stats.write(opts['-m'])
    conn.close()
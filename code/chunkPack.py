@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012-2013 Lukasz Bolikowski
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from cStringIO import StringIO
+import gzip
+import itertools
+import os
+import os.path
+import re
+import struct
+import sys
+import time
+
+PACK = '.pack'
+INDEX = '.idx'
+STAMP = '.stamp'
+ENTRY = struct.Struct('<QQQ')
+
+def compress(data):
+   buf = StringIO()
+   handle = gzip.GzipFile(fileobj = buf, mode = 'wb')
+   handle.write(data)
+   handle.close()
+   return buf.getvalue()
+
+def decompress(segment):
+   return gzip.GzipFile(fileobj = StringIO(segment)).read()
+
+class ChunkPack:
+   """Append-only store of harvested chunks.  The chunks are kept gzipped,
+   one after another, in <base>.pack; <base>.idx holds a fixed-size
+   (counter, offset, length) entry for each of them.  An entry is appended
+   only after its segment has been written, so a chunk is visible once it
+   is complete, and reading the whole pack is a single sequential scan.
+
+   <base>.stamp holds the time the pack was created, or last lost chunks to
+   truncate: chunks appended since may have taken the offsets of earlier
+   ones, so together with its offset and length it identifies a chunk."""
+
+   def __init__(self, base):
+      self.base = base
+      self.packHandle = None
+      self.indexHandle = None
+
+   def makeDirs(self):
+      directory = os.path.dirname(self.base)
+      if directory and not os.path.isdir(directory):
+         os.makedirs(directory)
+
+   def stamp(self):
+      if not os.path.exists(self.base + STAMP):
+         return 0.0
+      handle = open(self.base + STAMP, 'r')
+      stamp = float(handle.read())
+      handle.close()
+      return stamp
+
+   def renew(self):
+      """Records that chunks from now on may differ from earlier ones at the
+      same offsets.  This is done before anything is dropped, so that a
+      crash in between only makes readers check the chunks again."""
+
+      self.makeDirs()
+      handle = open(self.base + STAMP + '.tmp', 'w')
+      handle.write(repr(max(time.time(), self.stamp() + 1)))
+      handle.close()
+      os.rename(self.base + STAMP + '.tmp', self.base + STAMP)
+
+   def entries(self):
+      if not os.path.exists(self.base + INDEX):
+         return []
+      handle = open(self.base + INDEX, 'rb')
+      data = handle.read()
+      handle.close()
+      # a partially written entry is ignored
+      return [ENTRY.unpack_from(data, i) for i in xrange(0, len(data) - ENTRY.size + 1, ENTRY.size)]
+
+   def truncate(self, counter):
+      """Drops the chunks numbered above counter, and anything after the
+      last complete entry."""
+
+      self.close()
+      self.makeDirs()
+      entries = self.entries()
+      kept = [entry for entry in entries if entry[0] <= counter]
+      end = 0
+      if kept:
+         end = kept[-1][1] + kept[-1][2]
+      if not os.path.exists(self.base + PACK) or len(kept) < len(entries) or os.path.getsize(self.base + PACK) > end:
+         self.renew()
+      handle = open(self.base + INDEX, 'wb')
+      handle.write(''.join(ENTRY.pack(*entry) for entry in kept))
+      handle.close()
+      handle = open(self.base + PACK, 'ab')
+      handle.truncate(end)
+      handle.close()
+
+   def append(self, counter, segment):
+      """Appends a gzipped chunk."""
+
+      if self.packHandle == None:
+         self.makeDirs()
+         if not os.path.exists(self.base + PACK):
+            self.renew()
+         self.packHandle = open(self.base + PACK, 'ab')
+         self.indexHandle = open(self.base + INDEX, 'ab')
+      self.packHandle.seek(0, os.SEEK_END)
+      offset = self.packHandle.tell()
+      self.packHandle.write(segment)
+      self.packHandle.flush()
+      self.indexHandle.write(ENTRY.pack(counter, offset, len(segment)))
+      self.indexHandle.flush()
+
+   def read(self, offset, length):
+      handle = open(self.base + PACK, 'rb')
+      handle.seek(offset)
+      segment = handle.read(length)
+      handle.close()
+      return segment
+
+   def segments(self, spans):
+      """Yields the gzipped chunks at the given (offset, length) spans.  The
+      pack is opened once, and only read forward if the spans are in the
+      order of the index, so this is a single sequential pass."""
+
+      handle = open(self.base + PACK, 'rb')
+      for offset, length in spans:
+         handle.seek(offset)
+         yield handle.read(length)
+      handle.close()
+
+   def __iter__(self):
+      """Yields (counter, chunk) pairs in the order they were appended."""
+
+      entries = self.entries()
+      for (counter, _, _), segment in itertools.izip(entries, self.segments(entry[1:] for entry in entries)):
+         yield counter, decompress(segment)
+
+   def close(self):
+      if self.packHandle <> None:
+         self.packHandle.close()
+         self.indexHandle.close()
+         self.packHandle, self.indexHandle = None, None
+
+def convert(chunksDir, base):
+   """Packs a tree of %08x.xml or %08x.xml.gz chunk files, as written by
+   earlier versions of getOAI.py, in the order of their numbers."""
+
+   files = []
+   for root, dirs, names in os.walk(chunksDir):
+      for name in names:
+         match = re.match('([0-9a-f]{8})\.xml(\.gz)?$', name)
+         if match:
+            files.append((int(match.group(1), 16), os.path.join(root, name)))
+   files.sort()
+
+   pack = ChunkPack(base)
+   pack.truncate(-1)
+   for counter, fileName in files:
+      handle = open(fileName, 'rb')
+      data = handle.read()
+      handle.close()
+      if not fileName.endswith('.gz'):
+         data = compress(data)
+      pack.append(counter, data)
+   pack.close()
+   return len(files)
+
+if __name__ == "__main__":
+   if len(sys.argv) < 3:
+      print 'Usage: %s <chunks_dir> <pack_base>' % sys.argv[0]
+      print '  packs a chunk tree into <pack_base>%s and <pack_base>%s' % (PACK, INDEX)
+      sys.exit(1)
+   print 'Packed %d chunks' % convert(sys.argv[1], sys.argv[2])
+
+# vim:et:sw=3:ts=3
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012-2013 Lukasz Bolikowski
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import email.utils
+import getopt
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import SocketServer
+import sys
+import threading
+import time
+import urllib
+import wsgiref.simple_server
+
+import makeFiles
+import writeOPML
+
+PORT = 8080
+CACHE_SIZE = 1024
+POOL_SIZE = 8
+
+VENUE = re.compile('^/(conf|journals)/([^/]+)\.xml$')
+QUERY = re.compile('^/(authors|keywords)/([^/]+)\.xml$')
+OPML = re.compile('^/opml/([A-Z]+|all)\.opml$')
+
+class LRUCache:
+   """A dict holding at most size entries, which forgets the least recently
+   used entry to make room for a new one."""
+
+   def __init__(self, size):
+      self.size = size
+      self.entries = collections.OrderedDict()
+      self.lock = threading.Lock()
+
+   def get(self, key):
+      with self.lock:
+         value = self.entries.pop(key, None)
+         if value <> None:
+            self.entries[key] = value
+         return value
+
+   def put(self, key, value):
+      with self.lock:
+         self.entries.pop(key, None)
+         self.entries[key] = value
+         if len(self.entries) > self.size:
+            self.entries.popitem(last = False)
+
+   def clear(self):
+      with self.lock:
+         self.entries.clear()
+
+class FeedServer:
+   """WSGI application serving the files makeFiles.py and writeOPML.py
+   would write, rendered on request from the database with the same code.
+   Responses are kept in an LRU cache, which is emptied whenever the
+   database changes, and carry an ETag and Last-Modified header for
+   conditional requests.
+
+   The server starts a thread per request, so database connections are
+   kept in a small pool rather than per thread: a request that misses the
+   cache borrows one and gives it back."""
+
+   def __init__(self, dbFileName, cacheSize = CACHE_SIZE):
+      self.dbFileName = dbFileName
+      self.cache = LRUCache(cacheSize)
+      self.pool = []
+      self.lock = threading.Lock()
+      self.stamp = None
+
+   def version(self):
+      """Identifies the state of the database by the inode, mtime and size of
+      its file and write-ahead log.  The feeds also depend on the date, so
+      the cutoff is part of it too."""
+
+      stamp = [makeFiles.cutoff()]
+      for name in [self.dbFileName, self.dbFileName + '-wal']:
+         try:
+            stat = os.stat(name)
+            stamp.append((stat.st_ino, stat.st_mtime, stat.st_size))
+         except OSError:
+            stamp.append(None)
+      return tuple(stamp)
+
+   def acquire(self, stamp):
+      """Takes a connection opened at the given version of the database out
+      of the pool, or opens a new one.  Connections opened at an older
+      version are closed, as the database may have been replaced."""
+
+      with self.lock:
+         while self.pool:
+            connStamp, conn = self.pool.pop()
+            if connStamp == stamp:
+               return conn
+            conn.close()
+      conn = sqlite3.connect(self.dbFileName, check_same_thread = False)
+      conn.execute('PRAGMA query_only = ON')
+      return conn
+
+   def release(self, stamp, conn):
+      """Puts a connection back into the pool, unless the pool is full."""
+
+      with self.lock:
+         if len(self.pool) < POOL_SIZE:
+            self.pool.append((stamp, conn))
+            return
+      conn.close()
+
+   def render(self, conn, path, now):
+      """Renders the file at path.  Returns its content type, content and a
+      digest of its content apart from the build date, or None if there is
+      no such file."""
+
+      if path == '/index.json':
+         body = json.dumps(makeFiles.calc_toc(conn))
+         return 'application/json', body, hashlib.md5(body).hexdigest()
+      match = VENUE.match(path)
+      if match:
+         entry = conn.execute('SELECT key, kind, acronym, name, id FROM venue WHERE key = ? AND name IS NOT NULL',
+            ('%s/%s' % match.groups(),)).fetchone()
+         if not entry:
+            return None
+         _, fromYear = makeFiles.cutoff()
+         head, body = makeFiles.venue_feed(entry, makeFiles.venue_items(conn, fromYear, entry[4]))
+         return 'application/rss+xml', makeFiles.format_feed(head, body, now), hashlib.md5(''.join(head + body)).hexdigest()
+      match = QUERY.match(path)
+      if match:
+         try:
+            kind, query = match.group(1), urllib.unquote(match.group(2)).decode('utf-8')
+         except UnicodeDecodeError:
+            return None
+         if kind == 'keywords' and not makeFiles.has_titles(conn):
+            return None
+         _, fromYear = makeFiles.cutoff()
+         head, body = makeFiles.query_feed(kind, query, makeFiles.QUERIES[kind][0](conn, query, fromYear))
+         return 'application/rss+xml', makeFiles.format_feed(head, body, now), hashlib.md5(''.join(head + body)).hexdigest()
+      match = OPML.match(path)
+      if match:
+         feeds = writeOPML.opml_feeds(conn)
+         if match.group(1) == writeOPML.ALL:
+            body = writeOPML.all_opml(feeds)
+         else:
+            found = [(label, venues) for tag, label, venues in feeds if tag == match.group(1)]
+            if not found:
+               return None
+            body = writeOPML.tag_opml(*found[0])
+         return 'text/x-opml', body, hashlib.md5(body).hexdigest()
+      return None
+
+   def __call__(self, environ, start_response):
+      if environ['REQUEST_METHOD'] not in ['GET', 'HEAD']:
+         start_response('405 Method Not Allowed', [('Content-Type', 'text/plain'), ('Allow', 'GET, HEAD')])
+         return ['Method not allowed\n']
+
+      stamp = self.version()
+      with self.lock:
+         if stamp <> self.stamp:
+            self.cache.clear()
+            self.stamp = stamp
+      modified = max([0] + [version[1] for version in stamp[1:] if version])
+      path = environ.get('PATH_INFO', '/')
+      response = self.cache.get(path)
+      if response == None:
+         now = time.strftime(makeFiles.DATETIME_FORMAT, time.gmtime(modified))
+         conn = self.acquire(stamp)
+         try:
+            response = self.render(conn, path, now)
+         finally:
+            self.release(stamp, conn)
+         if response == None:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['Not found\n']
+         self.cache.put(path, response)
+
+      contentType, body, digest = response
+      headers = [('ETag', '"%s"' % digest),
+         ('Last-Modified', time.strftime(makeFiles.DATETIME_FORMAT, time.gmtime(modified)))]
+      if self.not_modified(environ, digest, modified):
+         start_response('304 Not Modified', headers)
+         return []
+      start_response('200 OK', headers + [('Content-Type', contentType), ('Content-Length', str(len(body)))])
+      if environ['REQUEST_METHOD'] == 'HEAD':
+         return []
+      return [body]
+
+   def not_modified(self, environ, digest, modified):
+      """Tells whether the client's copy is current, by its ETag if it sent
+      one, or else by its date."""
+
+      tags = environ.get('HTTP_IF_NONE_MATCH')
+      if tags <> None:
+         return '"%s"' % digest in [tag.strip() for tag in tags.split(',')] or tags.strip() == '*'
+      since = environ.get('HTTP_IF_MODIFIED_SINCE')
+      if since <> None:
+         date = email.utils.parsedate_tz(since)
+         return date <> None and int(modified) <= email.utils.mktime_tz(date)
+      return False
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn, wsgiref.simple_server.WSGIServer):
+   daemon_threads = True
+   request_queue_size = 128
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+   def log_message(self, format, *args):
+      pass
+
+def serve(dbFileName, port = PORT, cacheSize = CACHE_SIZE, quiet = False):
+   handler = [wsgiref.simple_server.WSGIRequestHandler, QuietHandler][quiet]
+   server = wsgiref.simple_server.make_server('', port, FeedServer(dbFileName, cacheSize), ThreadingWSGIServer, handler)
+   print 'Serving %s on port %d' % (dbFileName, port)
+   sys.stdout.flush()
+   server.serve_forever()
+
+if __name__ == "__main__":
+   def usage():
+      print 'Usage: %s [-p <port>] [-c <entries>] [-q] <index.sqlite>' % sys.argv[0]
+      print '  -p  port to listen on (default: %d)' % PORT
+      print '  -c  number of responses to cache (default: %d)' % CACHE_SIZE
+      print '  -q  do not log requests'
+
+   try:
+      opts, args = getopt.getopt(sys.argv[1:], 'p:c:q')
+   except getopt.GetoptError:
+      usage()
+      sys.exit(1)
+   opts = dict(opts)
+   if len(args) < 1:
+      usage()
+      sys.exit(1)
+   serve(args[0], int(opts.get('-p', PORT)), int(opts.get('-c', CACHE_SIZE)), '-q' in opts)
+
+# vim:et:sw=3:ts=3
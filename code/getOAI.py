@@ -23,74 +23,359 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import os, re, sys, time, urllib, xml.dom.minidom
+import email.utils, getopt, httplib, json, os, Queue, re, socket, sys, threading, time, urllib, urlparse, zlib
+from xml.sax.saxutils import unescape
+
+import chunkPack
+
+ATTEMPTS = 3
+BACKOFF = 30
+RETRY_AFTER = 30
+QUEUE_SIZE = 16
+TIMEOUT = 300
+STATE = 'harvest.json'
+PACK = 'chunks'
+
+TOKEN = re.compile('<resumptionToken[^>]*>([^<]*)</resumptionToken>')
+DAY = re.compile('^[0-9]{4}-[0-9]{2}-[0-9]{2}$')
+ERROR = re.compile('<error[^>]*code="([^"]*)"[^>]*>([^<]*)</error>')
+
+class OAIError(IOError):
+	"""An error response of the repository, with its OAI-PMH error code."""
+
+	def __init__(self, code, message):
+		IOError.__init__(self, '%s: %s' % (code, unescape(message.strip())))
+		self.code = code
 
 class OAIHarvester:
-	def __init__(self, url, settings, path = '.'):
+	"""Harvests ListRecords pages into a pack of numbered, gzipped chunks
+	(see chunkPack.py).  Pages are written on a background thread, while the
+	next one is being fetched.  After each chunk the harvest state is saved,
+	so that an interrupted harvest resumes where it stopped."""
+
+	def __init__(self, url, settings, path = '.', label = None):
 		self.url = url
 		self.settings = settings
 		self.path = path
+		self.label = label
 		self.counter = -1
+		self.queue = Queue.Queue(QUEUE_SIZE)
+		self.error = None
+		self.connection = None
+		self.pack = chunkPack.ChunkPack(path + os.sep + PACK)
+
+	def log(self, message):
+		if self.label <> None:
+			message = '[%s] %s' % (self.label, message)
+		print message
+		sys.stdout.flush()
 
 	def getFirst(self):
 		self.counter += 1
-		print "Chunk #" + str(self.counter)
+		self.log("Chunk #" + str(self.counter))
 		url = '%s?verb=ListRecords&%s' % (self.url, self.settings)
 		return self.getCommon(url)
 
 	def getNext(self, token):
 		self.counter += 1
-		print "Chunk #%d, token: %s" % (self.counter, token)
-		url = '%s?verb=ListRecords&resumptionToken=%s' % (self.url, token)
+		self.log("Chunk #%d, token: %s" % (self.counter, token))
+		url = '%s?verb=ListRecords&resumptionToken=%s' % (self.url, urllib.quote(token, ''))
 		return self.getCommon(url)
 
 	def getCommon(self, url):
+		if self.error <> None:
+			raise self.error
+		page = self.fetch(url)
+		if page == None:
+			raise IOError, 'Giving up on chunk #%d' % self.counter
+		data, compressed = page
+		error = self.getError(data)
+		if error <> None and error.code == 'noRecordsMatch':
+			# nothing changed in the window: there is no chunk to store,
+			# but the harvest is complete
+			self.log("No records")
+			self.queue.put((self.counter - 1, None, None, None))
+			return None
+		if error <> None:
+			raise error
+		token = self.getToken(data)
+		self.queue.put((self.counter, data, compressed, token))
+		return token
+
+	def request(self, url):
+		"""Sends a GET over the persistent connection, asking for gzip.
+		Returns the response and its raw body.  If the server has closed a
+		reused connection in the meantime, the request is sent again over a
+		new one."""
+
+		parts = urlparse.urlsplit(url)
+		reused = self.connection <> None
+		while True:
+			if self.connection == None:
+				if parts.scheme == 'https':
+					self.connection = httplib.HTTPSConnection(parts.netloc, timeout = TIMEOUT)
+				else:
+					self.connection = httplib.HTTPConnection(parts.netloc, timeout = TIMEOUT)
+			try:
+				self.connection.request('GET', parts.path + '?' + parts.query, headers = {'Accept-Encoding': 'gzip'})
+				response = self.connection.getresponse()
+				return response, response.read()
+			except (httplib.HTTPException, socket.error):
+				self.connection.close()
+				self.connection = None
+				if not reused:
+					raise
+				reused = False
+
+	def fetch(self, url):
+		"""Fetches a page.  A 503 response means the server wants us to slow
+		down: we wait as long as its Retry-After header says and try again,
+		without counting it as a failed attempt.  Other failures are retried
+		with exponential backoff, ATTEMPTS times in total.  Returns the page,
+		and the page gzipped if that is how the server sent it."""
+
 		attempt = 0
-		while attempt < 3:
+		while attempt < ATTEMPTS:
 			try:
-				data = urllib.urlopen(url).read()
-				path = self.path + os.sep + ('%04x' % (self.counter / 65536)) + os.sep + ('%02x' % (self.counter % 65536 / 256))
-				if not os.path.isdir(path):
-					os.makedirs(path)
-				name = path + os.sep + ('%08x' % self.counter) + '.xml'
-				file = open(name, 'w')
-				file.write(data)
-				file.close()
-				token = self.getToken(data)
-				return token
-			except:
-				attempt += 1
-			finally:
-				time.sleep(30)
+				response, body = self.request(url)
+				if response.status == 200:
+					if response.getheader('Content-Encoding') == 'gzip':
+						return zlib.decompress(body, 16 + zlib.MAX_WBITS), body
+					return body, None
+				if response.status == 503:
+					delay = self.retryAfter(response.getheader('Retry-After'))
+					self.log("Server busy, retrying in %d s" % delay)
+					time.sleep(delay)
+					continue
+				reason = 'HTTP %d %s' % (response.status, response.reason)
+			except (httplib.HTTPException, socket.error, zlib.error), e:
+				reason = '%s: %s' % (e.__class__.__name__, e)
+			attempt += 1
+			self.log("Attempt %d failed: %s" % (attempt, reason))
+			if attempt < ATTEMPTS:
+				time.sleep(BACKOFF * 2 ** (attempt - 1))
 		return None
 
+	def retryAfter(self, value):
+		"""Parses a Retry-After header, given either in seconds or as a date."""
+
+		if value == None:
+			return RETRY_AFTER
+		value = value.strip()
+		if value.isdigit():
+			return int(value)
+		date = email.utils.parsedate_tz(value)
+		if date == None:
+			return RETRY_AFTER
+		return max(0, int(email.utils.mktime_tz(date) - time.time()))
+
 	def getToken(self, data):
-		dom = xml.dom.minidom.parseString(data)
-		tmp = dom.getElementsByTagName('resumptionToken')
-		if tmp == None or len(tmp) == 0:
+		"""Finds the resumption token, which comes at the end of the page,
+		without parsing the page."""
+
+		start = data.rfind('<resumptionToken')
+		if start < 0:
 			return None
-		token = tmp[0].childNodes[0].data
-		return token
+		match = TOKEN.match(data, start)
+		if match == None or match.group(1).strip() == '':
+			return None
+		return unescape(match.group(1).strip())
+
+	def getError(self, data):
+		"""Returns the error a page reports instead of records, if any."""
+
+		if data.find('<ListRecords') >= 0:
+			return None
+		match = ERROR.search(data)
+		if match == None:
+			return None
+		return OAIError(match.group(1), match.group(2))
+
+	def store(self, counter, data, compressed):
+		if compressed == None:
+			compressed = chunkPack.compress(data)
+		self.pack.append(counter, compressed)
+
+	def loadState(self):
+		name = self.path + os.sep + STATE
+		if not os.path.exists(name):
+			return None
+		file = open(name, 'r')
+		state = json.load(file)
+		file.close()
+		if state['url'] <> self.url or state['settings'] <> self.settings:
+			raise ValueError, 'State in %s belongs to a different harvest' % name
+		return state
+
+	def saveState(self, counter, token):
+		"""Records that chunks up to counter are on disk, and the token to
+		fetch the next one with; None when the harvest is complete."""
+
+		if not os.path.isdir(self.path):
+			os.makedirs(self.path)
+		name = self.path + os.sep + STATE
+		file = open(name + '.tmp', 'w')
+		json.dump({'url': self.url, 'settings': self.settings, 'counter': counter, 'token': token, 'done': token == None}, file)
+		file.close()
+		os.rename(name + '.tmp', name)
+
+	def writeChunks(self):
+		while True:
+			item = self.queue.get()
+			if item == None:
+				break
+			if self.error <> None:
+				continue
+			counter, data, compressed, token = item
+			try:
+				if data <> None:
+					self.store(counter, data, compressed)
+				self.saveState(counter, token)
+			except EnvironmentError, e:
+				# reported to the harvesting thread, which stops
+				self.error = e
 
 	def harvest(self, chunk = None, token = None):
-		if chunk <> None:
-			self.counter = chunk - 1
-		if token == None:
-			token = self.getFirst()
-		while token <> None:
-			token = oai.getNext(token)
-		print "Done"
+		"""Harvests from the given chunk and token, or else from where the
+		saved state says the previous run stopped, or else from scratch.
+		Raises IOError if a page cannot be fetched or the repository reports
+		an error, after saving the chunks fetched so far.  A resumption
+		token the repository no longer accepts when resuming is expired,
+		and the harvest then starts over."""
+
+		if chunk == None and token == None:
+			state = self.loadState()
+			if state <> None and state['done']:
+				self.log("Already done")
+				return
+			if state <> None:
+				chunk, token = state['counter'] + 1, state['token']
+				self.log("Resuming at chunk #%d" % chunk)
+		# chunks stored after the state was last saved are fetched again
+		self.pack.truncate((chunk or 0) - 1)
+		writer = threading.Thread(target = self.writeChunks)
+		writer.start()
+		expired = False
+		try:
+			if chunk <> None:
+				self.counter = chunk - 1
+			if token == None:
+				token = self.getFirst()
+			while token <> None:
+				token = self.getNext(token)
+		except OAIError, e:
+			expired = e.code == 'badResumptionToken' and self.counter == chunk
+			if not expired:
+				raise
+		finally:
+			self.queue.put(None)
+			writer.join()
+			self.pack.close()
+			if self.connection <> None:
+				self.connection.close()
+		if self.error <> None:
+			raise self.error
+		if expired:
+			self.log("Resumption token expired, starting over")
+			self.harvest(0)
+			return
+		self.log("Done")
+
+	def isDone(self):
+		state = self.loadState()
+		return state <> None and state['done']
+
+def harvestParallel(url, settings, path, windows, sets):
+	"""Harvests disjoint date windows and/or sets concurrently, each into its
+	own subdirectory of path.  Raises IOError, once they have all stopped,
+	if any of them failed."""
+
+	harvesters = []
+	for window in windows or [None]:
+		for oaiSet in sets or [None]:
+			extra, labels = settings, []
+			if window <> None:
+				extra += '&from=%s&until=%s' % window
+				labels.append('%s_%s' % window)
+			if oaiSet <> None:
+				extra += '&set=%s' % oaiSet
+				labels.append(re.sub('[^a-zA-Z0-9_.-]', '_', oaiSet))
+			label = '+'.join(labels)
+			harvesters.append(OAIHarvester(url, extra, path + os.sep + label, label))
+
+	failed = []
+	def run(harvester):
+		try:
+			harvester.harvest()
+		except Exception, e:
+			harvester.log("Failed: %s" % e)
+			failed.append(harvester.label)
+
+	threads = [threading.Thread(target = run, args = (h,)) for h in harvesters]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	if failed:
+		raise IOError, '%d of %d harvests failed: %s' % (len(failed), len(harvesters), ', '.join(sorted(failed)))
+
+def harvestIncremental(url, settings, path):
+	"""Harvests what changed since the previous harvest.  Every harvest goes
+	into a subdirectory of path named after the (UTC) day it started, and
+	asks for records from the day the previous one started.  Harvests that
+	did not finish are resumed first, oldest first, and a new one is only
+	started once all of them are done, so that no window is left out."""
+
+	days = []
+	if os.path.isdir(path):
+		days = sorted(name for name in os.listdir(path) if DAY.match(name))
+
+	def settingsFor(i):
+		if i == 0:
+			return settings
+		return '%s&from=%s' % (settings, days[i - 1])
+
+	today = time.strftime('%Y-%m-%d', time.gmtime())
+	for i, day in enumerate(days):
+		harvester = OAIHarvester(url, settingsFor(i), path + os.sep + day, day)
+		if not harvester.isDone():
+			harvester.harvest()
+	if not days or days[-1] <> today:
+		days.append(today)
+		OAIHarvester(url, settingsFor(len(days) - 1), path + os.sep + today, today).harvest()
 
 if __name__ == "__main__":
-	if len(sys.argv) < 3:
-		print 'Usage: ' + sys.argv[0] + ' <url> <settings> [<path>] [<chunk> <token>]'
+	def usage():
+		print 'Usage: ' + sys.argv[0] + ' [-i] [-w <from>/<until>]... [-s <set>]... <url> <settings> [<path>] [<chunk> <token>]'
+		print '  -i  incremental: harvest what changed since the previous harvest in <path>'
+		print '  -w  harvest this date window, concurrently with the other windows'
+		print '  -s  harvest this set, concurrently with the other sets'
+
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'iw:s:')
+	except getopt.GetoptError:
+		usage()
+		sys.exit(1)
+	windows = [tuple(value.split('/', 1)) for option, value in opts if option == '-w']
+	sets = [value for option, value in opts if option == '-s']
+	if len(args) < 2 or [w for w in windows if len(w) <> 2]:
+		usage()
+		sys.exit(1)
+	url, settings, path, chunk, token = args[0], args[1], '.', None, None
+	if len(args) > 2:
+		path = args[2]
+	if len(args) > 3:
+		chunk = int(args[3])
+	if len(args) > 4:
+		token = args[4]
+	try:
+		if ('-i', '') in opts:
+			harvestIncremental(url, settings, path)
+		elif windows or sets:
+			harvestParallel(url, settings, path, windows, sets)
+		else:
+			oai = OAIHarvester(url, settings, path)
+			oai.harvest(chunk, token)
+	except EnvironmentError, e:
+		print >>sys.stderr, 'Harvest failed: %s' % e
 		sys.exit(1)
-	url, settings, path, chunk, token = sys.argv[1], sys.argv[2], '.', 0, None
-	if len(sys.argv) > 3:
-		path = sys.argv[3]
-	if len(sys.argv) > 4:
-		chunk = int(sys.argv[4])
-	if len(sys.argv) > 5:
-		token = sys.argv[5]
-	oai = OAIHarvester(url, settings, path)
-	oai.harvest(chunk, token)
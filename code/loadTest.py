@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012-2013 Lukasz Bolikowski
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import getopt
+import httplib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urlparse
+
+CONCURRENCY = 8
+REQUESTS = 10000
+
+def paths(base):
+   """Lists the feeds in the index of the server at base, the most popular
+   first as far as the load test is concerned."""
+
+   parts = urlparse.urlsplit(base)
+   conn = httplib.HTTPConnection(parts.netloc)
+   conn.request('GET', parts.path.rstrip('/') + '/index.json')
+   toc = json.loads(conn.getresponse().read())
+   conn.close()
+   prefix = parts.path.rstrip('/')
+   return [prefix + '/index.json'] + [prefix + '/%s.xml' % re.sub('[^a-zA-Z0-9_/-]', '', entry[0]) for entry in toc]
+
+def worker(netloc, paths, count, seed, latencies, errors, revalidate):
+   """Sends count requests, picking feeds with a long-tailed popularity, and
+   records the latency of each.  wsgiref answers with HTTP/1.0 and closes
+   the connection, so httplib opens a new one for every request, and the
+   latencies include connecting."""
+
+   rnd = random.Random(seed)
+   conn = httplib.HTTPConnection(netloc)
+   etags = {}
+   for i in xrange(count):
+      path = paths[min(int(rnd.paretovariate(1.0)), len(paths)) - 1]
+      headers = {}
+      if revalidate and path in etags:
+         headers['If-None-Match'] = etags[path]
+      start = time.time()
+      try:
+         conn.request('GET', path, headers = headers)
+         response = conn.getresponse()
+         response.read()
+         if response.status not in [200, 304]:
+            errors.append(response.status)
+         elif response.getheader('ETag'):
+            etags[path] = response.getheader('ETag')
+      except (httplib.HTTPException, EnvironmentError), e:
+         errors.append(str(e))
+         conn.close()
+         conn = httplib.HTTPConnection(netloc)
+      latencies.append(time.time() - start)
+   conn.close()
+
+def percentile(values, fraction):
+   return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def load_test(base, concurrency = CONCURRENCY, requests = REQUESTS, revalidate = False):
+   feeds = paths(base)
+   latencies, errors = [], []
+   netloc = urlparse.urlsplit(base).netloc
+   threads = [threading.Thread(target = worker, args = (netloc, feeds, requests / concurrency, i, latencies, errors, revalidate))
+      for i in xrange(concurrency)]
+   start = time.time()
+   for thread in threads:
+      thread.start()
+   for thread in threads:
+      thread.join()
+   elapsed = time.time() - start
+
+   latencies.sort()
+   print '%d requests to %d paths, %d concurrent, %d errors' % (len(latencies), len(feeds), concurrency, len(errors))
+   for error in sorted(set(errors)):
+      print '  error: %s' % error
+   print '%.0f requests/s' % (len(latencies) / elapsed)
+   print 'latency ms: p50 %.1f  p90 %.1f  p99 %.1f  max %.1f' % tuple(1000 * percentile(latencies, f) for f in [0.5, 0.9, 0.99, 1.0])
+
+if __name__ == "__main__":
+   def usage():
+      print 'Usage: %s [-c <concurrency>] [-n <requests>] [-r] <base_url>' % sys.argv[0]
+      print '  -c  number of concurrent clients (default: %d)' % CONCURRENCY
+      print '  -n  total number of requests (default: %d)' % REQUESTS
+      print '  -r  revalidate: send the ETag of the previous response to the same URL'
+
+   try:
+      opts, args = getopt.getopt(sys.argv[1:], 'c:n:r')
+   except getopt.GetoptError:
+      usage()
+      sys.exit(1)
+   opts = dict(opts)
+   if len(args) < 1:
+      usage()
+      sys.exit(1)
+   load_test(args[0], int(opts.get('-c', CONCURRENCY)), int(opts.get('-n', REQUESTS)), '-r' in opts)
+
+# vim:et:sw=3:ts=3
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012-2013 Lukasz Bolikowski
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+import getopt
+import gzip
+import os
+import os.path
+import random
+import shutil
+import sys
+
+import chunkPack
+
+DTD = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dblp.dtd')
+
+WORDS = ('learning graph model data network system analysis algorithm query '
+   'optimization distributed parallel neural deep search semantic software '
+   'verification logic program language secure privacy efficient scalable '
+   'robust adaptive online approximate probabilistic streaming index storage '
+   'cloud mobile sensor wireless image video recognition retrieval ranking '
+   'clustering classification inference reasoning planning agent game web '
+   'social recommendation compiler memory cache processor energy fault').split()
+FILLER = ['on', 'the', 'of', 'for', 'a', 'with', 'in', 'towards', 'and']
+CATEGORIES = ['cs.AI', 'cs.CL', 'cs.CR', 'cs.CV', 'cs.DB', 'cs.DC', 'cs.DS',
+   'cs.IR', 'cs.LG', 'cs.LO', 'cs.NI', 'cs.PL', 'cs.SE']
+RECORDS_PER_CHUNK = 1000
+
+def venue(rnd, venues):
+   """Picks a venue with a long-tailed distribution: a few venues publish
+   most papers, as in DBLP."""
+
+   index = min(int(rnd.paretovariate(1.1)), venues) - 1
+   kind = ['conf', 'journals'][index % 3 == 2]
+   return kind, 'v%d' % index
+
+def title(rnd):
+   words = [rnd.choice(WORDS) for i in xrange(rnd.randint(3, 8))]
+   for i in xrange(rnd.randint(0, 3)):
+      words.insert(rnd.randint(0, len(words)), rnd.choice(FILLER))
+   return ' '.join(words).capitalize()
+
+def document(seed, i, venues):
+   """The attributes of document i.  They only depend on the seed and i, so
+   that arXiv records can refer to DBLP documents without keeping them."""
+
+   rnd = random.Random(seed * 1000003 + i)
+   kind, acronym = venue(rnd, venues)
+   age = rnd.randint(0, 1500)
+   return {'kind': kind, 'acronym': acronym, 'title': '%s %d' % (title(rnd), i),
+      'mdate': datetime.date.today() - datetime.timedelta(age), 'authors': rnd.randint(1, 6)}
+
+def make_venues(dirName, venues):
+   """Writes a dblp_bht.xml listing every venue."""
+
+   handle = open(os.path.join(dirName, 'dblp_bht.xml'), 'w')
+   handle.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<bhts>\n')
+   for index in xrange(venues):
+      kind = ['conf', 'journals'][index % 3 == 2]
+      handle.write('<bht key="/db/%s/v%d/index.bht" title="Venue %d on %s">\n' % (kind, index, index, WORDS[index % len(WORDS)]))
+   handle.write('</bhts>\n')
+   handle.close()
+
+def make_dump(dirName, size, seed = 1, venues = 1000):
+   """Writes a synthetic, DTD-valid dblp.xml.gz with the given number of
+   documents, and a copy of the DTD next to it."""
+
+   rnd = random.Random(seed)
+   shutil.copy(DTD, os.path.join(dirName, 'dblp.dtd'))
+   handle = gzip.open(os.path.join(dirName, 'dblp.xml.gz'), 'w')
+   handle.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<!DOCTYPE dblp SYSTEM "dblp.dtd">\n<dblp>\n')
+   for i in xrange(size):
+      doc = document(seed, i, venues)
+      kind, acronym = doc['kind'], doc['acronym']
+      tag = ['inproceedings', 'article'][kind == 'journals']
+      handle.write('<%s mdate="%s" key="%s/%s/X%d">\n' % (tag, doc['mdate'], kind, acronym, i))
+      for j in xrange(doc['authors']):
+         handle.write('<author>Author M&uuml;ller %d</author>\n' % rnd.randint(1, size))
+      words = doc['title'].split(' ')
+      handle.write('<title>%s <i>%s</i> %s.</title>\n' % (words[0], words[1], ' '.join(words[2:])))
+      handle.write('<pages>%d-%d</pages>\n<year>%d</year>\n' % (i % 100, i % 100 + 10, doc['mdate'].year))
+      if i % 50:
+         handle.write('<ee>http://dx.doi.org/10.1000/%d</ee>\n' % i)
+      handle.write('<url>db/%s/%s/%s%d.html#X%d</url>\n</%s>\n' % (kind, acronym, acronym, i % 10, i, tag))
+      if i % 10 == 0:
+         handle.write('<www mdate="2013-01-01" key="homepages/%d"><author>Author %d</author><title>Home Page</title></www>\n' % (i, i))
+   handle.write('</dblp>\n')
+   handle.close()
+
+def arxiv_record(rnd, seed, documents, venues, overlap):
+   """Returns an arXiv title and categories.  With the given probability
+   the paper is a DBLP document, with its title in a different case and
+   punctuation, and categories typical of its venue."""
+
+   if documents and rnd.random() < overlap:
+      doc = document(seed, rnd.randrange(documents), venues)
+      primary = CATEGORIES[hash(doc['acronym']) % len(CATEGORIES)]
+      return doc['title'].upper().replace(' ', ', ', 1), [primary, rnd.choice(CATEGORIES), 'math.CO']
+   return '%s (extended)' % title(rnd), [rnd.choice(CATEGORIES)]
+
+def make_arxiv(dirName, size, documents, seed = 1, venues = 1000, overlap = 0.3, tree = False):
+   """Writes size arXiv records as OAI-PMH ListRecords pages, into a chunk
+   pack as getOAI.py does, or with tree set into a %08x.xml file tree."""
+
+   rnd = random.Random(seed + 1)
+   chunksDir = os.path.join(dirName, 'arXiv')
+   pack = chunkPack.ChunkPack(os.path.join(chunksDir, 'chunks'))
+   for counter, start in enumerate(xrange(0, size, RECORDS_PER_CHUNK)):
+      out = ['<?xml version="1.0" encoding="UTF-8"?>\n<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">\n<ListRecords>\n']
+      for i in xrange(start, min(size, start + RECORDS_PER_CHUNK)):
+         name, categories = arxiv_record(rnd, seed, documents, venues, overlap)
+         out.append('<record><header><identifier>oai:arXiv.org:%d</identifier></header><metadata>'
+            '<arXiv xmlns="http://arxiv.org/OAI/arXiv/"><id>%d</id><title>%s</title><categories>%s</categories>'
+            '</arXiv></metadata></record>\n' % (i, i, name, ' '.join(categories)))
+      if start + RECORDS_PER_CHUNK < size:
+         out.append('<resumptionToken cursor="%d">%d|%d</resumptionToken>\n' % (start, seed, counter + 1))
+      out.append('</ListRecords>\n</OAI-PMH>\n')
+      data = ''.join(out)
+      if tree:
+         path = os.path.join(chunksDir, '%04x' % (counter / 65536), '%02x' % (counter % 65536 / 256))
+         if not os.path.isdir(path):
+            os.makedirs(path)
+         handle = open(os.path.join(path, '%08x.xml' % counter), 'w')
+         handle.write(data)
+         handle.close()
+      else:
+         pack.append(counter, chunkPack.compress(data))
+   pack.close()
+
+def make_corpus(dirName, documents, arxiv = None, venues = 1000, seed = 1, tree = False):
+   """Writes dblp_bht.xml, dblp.xml.gz and an arXiv harvest to dirName.  By
+   default there are a third as many arXiv records as DBLP documents."""
+
+   if arxiv == None:
+      arxiv = documents / 3
+   make_venues(dirName, venues)
+   make_dump(dirName, documents, seed, venues)
+   make_arxiv(dirName, arxiv, documents, seed, venues, tree = tree)
+
+if __name__ == "__main__":
+   def usage():
+      print 'Usage: %s [-a <arxiv>] [-v <venues>] [-s <seed>] [-t] <dir> <documents>' % sys.argv[0]
+      print '  -a  number of arXiv records (default: a third of <documents>)'
+      print '  -v  number of venues (default: 1000)'
+      print '  -s  random seed (default: 1)'
+      print '  -t  write arXiv chunks as a file tree instead of a pack'
+
+   try:
+      opts, args = getopt.getopt(sys.argv[1:], 'a:v:s:t')
+   except getopt.GetoptError:
+      usage()
+      sys.exit(1)
+   opts = dict(opts)
+   if len(args) < 2:
+      usage()
+      sys.exit(1)
+   arxiv = None
+   if '-a' in opts:
+      arxiv = int(opts['-a'])
+   if not os.path.isdir(args[0]):
+      os.makedirs(args[0])
+   make_corpus(args[0], int(args[1]), arxiv, int(opts.get('-v', 1000)), int(opts.get('-s', 1)), '-t' in opts)
+
+# vim:et:sw=3:ts=3
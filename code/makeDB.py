@@ -23,14 +23,44 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from lxml import etree
+from cStringIO import StringIO
+import collections
 import datetime
+import getopt
 import gzip
+import hashlib
+import multiprocessing
+import os.path
 import re
 import sqlite3
+import struct
 import sys
+import time
 import xml.sax
 
+import metrics
+
 KINDS = ['conf', 'journals']
+PARSERS = ['sax', 'lxml']
+SHARD_SIZE = 16 * 1024 * 1024
+BATCH_SIZE = 10000
+CACHE_SIZE = 256 * 1024
+# byvenuedate covers the TOC query, which then never reads the records
+INDEXES = [('byvenuedate', 'CREATE INDEX IF NOT EXISTS byvenuedate ON record (venue, date DESC, year)'),
+   ('bynorm', 'CREATE INDEX IF NOT EXISTS bynorm ON record (norm)'),
+   ('byauthor', 'CREATE INDEX IF NOT EXISTS byauthor ON authorship (author)')]
+# keep the full-text index of titles in step with the record table
+TRIGGERS = [('titlesinsert', 'CREATE TRIGGER IF NOT EXISTS titlesinsert AFTER INSERT ON record BEGIN '
+      'INSERT INTO titles (rowid, title) VALUES (new.id, new.title); END'),
+   ('titlesdelete', 'CREATE TRIGGER IF NOT EXISTS titlesdelete AFTER DELETE ON record BEGIN '
+      'INSERT INTO titles (titles, rowid, title) VALUES (\'delete\', old.id, old.title); END')]
+
+TOPLEVEL = ['article', 'inproceedings', 'proceedings', 'book', 'incollection',
+   'phdthesis', 'mastersthesis', 'www', 'person', 'data']
+PRIMARY = ['article', 'inproceedings']
+SECONDARY = ['author', 'ee', 'title', 'url', 'year']
+MULTIPLE = ['author']
 
 class EventHandler(xml.sax.handler.ContentHandler):
    """SAX content handler using coroutines.
@@ -56,6 +86,23 @@ def parse_xml(target, content):
    parser.setContentHandler(EventHandler(target))
    parser.parse(content)
 
+def normalize_title(title):
+   """Reduces a title to lowercase letters and digits, so that titles can
+   be matched across sources."""
+
+   return re.sub('[^a-z0-9]', '', title.lower())
+
+def title_key(title):
+   """Returns a 64-bit hash of the normalized title.  Titles are matched
+   on it, which keeps the indexes on titles small."""
+
+   return struct.unpack('<q', hashlib.md5(normalize_title(title).encode('utf-8')).digest()[:8])[0]
+
+def to_day(date):
+   """Converts a YYYY-MM-DD date to the YYYYMMDD integer it is stored as."""
+
+   return int(date.replace('-', ''))
+
 def coroutine(func):
    """Decorator for easier handling of coroutines.
    See: http://www.dabeaz.com/coroutines/"""
@@ -70,10 +117,6 @@ def coroutine(func):
 def to_records(target):
    """Converts SAX event to records describing documents."""
 
-   PRIMARY = ['article', 'inproceedings']
-   SECONDARY = ['author', 'ee', 'title', 'url', 'year']
-   MULTIPLE = ['author']
-
    while True:
       event, args = (yield)
       if event == 'start' and args[0] in PRIMARY:
@@ -98,109 +141,492 @@ def to_records(target):
                target.send(record)
                break
 
+def iterparse_records(target, source):
+   """Converts the dump to records describing documents using lxml.
+   Top-level elements are discarded as soon as they have been read."""
+
+   for _, element in etree.iterparse(source, events = ('end',), tag = TOPLEVEL,
+         load_dtd = True, huge_tree = True):
+      if element.tag in PRIMARY:
+         record = {'key': element.get('key'), 'mdate': element.get('mdate')}
+         for child in element:
+            if child.tag not in SECONDARY:
+               continue
+            text = ''.join(child.itertext()).strip()
+            if child.tag in MULTIPLE:
+               record.setdefault(child.tag, []).append(text)
+            else:
+               record[child.tag] = text
+         target.send(record)
+      element.clear()
+      while element.getprevious() is not None:
+         del element.getparent()[0]
+
+def drop(state, reason):
+   """Counts a discarded document under the given reason."""
+
+   dropped = state.setdefault('dropped', {})
+   dropped[reason] = dropped.get(reason, 0) + 1
+
+def merge_counts(state, other):
+   """Adds the documents seen and dropped in other to state."""
+
+   state['seen'] = state.get('seen', 0) + other.get('seen', 0)
+   dropped = state.setdefault('dropped', {})
+   for reason, count in other.get('dropped', {}).iteritems():
+      dropped[reason] = dropped.get(reason, 0) + count
+
 @coroutine
-def filter_incomplete(target):
+def filter_incomplete(state, target):
    """Discards incomplete document descriptions."""
 
    while True:
       record = (yield)
       if 'author' not in record:
+         drop(state, 'no_author')
          continue
       if 'ee' not in record or not record['ee'].startswith('http'):
+         drop(state, 'no_ee')
          continue
       if 'title' not in record:
+         drop(state, 'no_title')
          continue
       if 'url' not in record:
+         drop(state, 'no_url')
          continue
       target.send(record)
 
 @coroutine
-def filter_by_date(fromDate, target):
+def filter_by_date(fromDate, state, target):
    """Picks documents that were modified on or after the given date."""
 
    while True:
       record = (yield)
       modDate = datetime.datetime.strptime(record['mdate'], "%Y-%m-%d")
       if modDate < fromDate:
+         drop(state, 'unchanged')
          continue
       target.send(record)
 
 @coroutine
-def filter_by_venue(target):
-   """Picks documents that were published at the given venues."""
+def track_mdate(state, target):
+   """Remembers the most recent modification date seen, and counts the
+   documents."""
 
    while True:
       record = (yield)
-      match = re.match('db/([^/]*)/([^/]*)/.*', record['url'])
-      if not match:
-         continue
-      if not str(match.group(1)) in KINDS:
-         continue
-      record['venue'] = str(match.group(1)) + '/' + str(match.group(2))
+      state['seen'] = state.get('seen', 0) + 1
+      if record['mdate'] > state.get('mdate', ''):
+         state['mdate'] = record['mdate']
       target.send(record)
 
 @coroutine
-def store(conn):
-   """Store records in database."""
+def tee_keys(keys, target):
+   """Passes the keys of documents on to a separate target."""
 
    while True:
       record = (yield)
+      keys.send(record['key'])
+      target.send(record)
+
+@coroutine
+def purge(conn):
+   """Removes stored versions of documents that are about to be re-ingested."""
+
+   while True:
+      key = (yield)
+      conn.execute('DELETE FROM authorship WHERE record = (SELECT id FROM record WHERE key = ?)', (key,))
+      conn.execute('DELETE FROM record WHERE key = ?', (key,))
+
+@coroutine
+def collect(items):
+   """Appends everything it receives to a list."""
 
-      authors = ', '.join(record['author'])
+   while True:
+      items.append((yield))
 
-      conn.execute('INSERT INTO record VALUES (?, ?, ?, ?, ?, ?)',
-         (record['title'], authors, record['mdate'], record['ee'], record['venue'], record['year']))
+@coroutine
+def filter_by_venue(state, target):
+   """Picks documents that were published at the given venues."""
 
-def parse_records(conn, fileName):
+   while True:
+      record = (yield)
+      match = re.match('db/([^/]*)/([^/]*)/.*', record['url'])
+      if not match:
+         drop(state, 'no_venue')
+         continue
+      if not str(match.group(1)) in KINDS:
+         drop(state, 'kind')
+         continue
+      record['venue'] = str(match.group(1)) + '/' + str(match.group(2))
+      target.send(record)
 
-   chain = store(conn)
-   chain = filter_by_venue(chain)
-   chain = filter_incomplete(chain)
-   chain = to_records(chain)
+def to_rows(records):
+   """Prepares the parameters of the statements storing the given records,
+   as insert_rows takes them: the keys, the venues, the (key, title, date,
+   link, venue, year, norm) rows of the records, with the venue given by
+   its key, the author names and the (key, position, name) authorship
+   rows.  All the work done per record is done here, so that with several
+   parser processes it is done in them, and the process writing to the
+   database only runs the statements."""
+
+   venues = set(record['venue'] for record in records)
+   return ([(record['key'],) for record in records],
+      [(venue,) + tuple(venue.split('/', 1)) for venue in sorted(venues)],
+      [(record['key'], record['title'], to_day(record['mdate']), record['ee'], record['venue'],
+         int(record['year']), title_key(record['title'])) for record in records],
+      [(name,) for record in records for name in record['author']],
+      [(record['key'], pos, name) for record in records for pos, name in enumerate(record['author'])])
+
+def insert_rows(conn, state, rows):
+   """Stores records prepared by to_rows.  Venues missing from
+   dblp_bht.xml are added without a name, and are left out of the TOC.
+   Every author name is stored once in the author table, and the records
+   refer to it through authorship.  Earlier versions of the records are
+   deleted rather than replaced, so that the triggers maintaining the title
+   index see them go."""
+
+   keys, venues, records, authors, authorships = rows
+   if not keys:
+      return
+   venues = conn.executemany('INSERT OR IGNORE INTO venue (key, kind, acronym) VALUES (?, ?, ?)', venues).rowcount
+   conn.executemany('DELETE FROM authorship WHERE record = (SELECT id FROM record WHERE key = ?)', keys)
+   conn.executemany('DELETE FROM record WHERE key = ?', keys)
+   conn.executemany('INSERT INTO record (key, title, date, link, venue, year, norm) VALUES (?, ?, ?, ?, (SELECT id FROM venue WHERE key = ?), ?, ?)', records)
+   authors = conn.executemany('INSERT OR IGNORE INTO author (name) VALUES (?)', authors).rowcount
+   authorships = conn.executemany('INSERT INTO authorship VALUES ((SELECT id FROM record WHERE key = ?), ?, (SELECT id FROM author WHERE name = ?))',
+      authorships).rowcount
+   state['stored'] = state.get('stored', 0) + len(keys)
+   state['venues'] = state.get('venues', 0) + max(venues, 0)
+   state['authors'] = state.get('authors', 0) + max(authors, 0)
+   state['authorships'] = state.get('authorships', 0) + max(authorships, 0)
 
+@coroutine
+def store(conn, state, batch = BATCH_SIZE):
+   """Store records in database, in batches of the given size.  The last
+   batch is written when the coroutine is closed."""
+
+   records = []
+   try:
+      while True:
+         records.append((yield))
+         if len(records) >= batch:
+            insert_rows(conn, state, to_rows(records))
+            records = []
+   except GeneratorExit:
+      insert_rows(conn, state, to_rows(records))
+
+def filters(target, state, fromDate = None, changed = None):
+   """Builds the chain of filters in front of the target.  With fromDate
+   given, keys of documents to be re-ingested are sent to changed."""
+
+   chain = filter_by_venue(state, target)
+   chain = filter_incomplete(state, chain)
+   if fromDate:
+      chain = tee_keys(changed, chain)
+      chain = filter_by_date(fromDate, state, chain)
+   return track_mdate(state, chain)
+
+def parse_stream(chain, content, parser):
+   if parser == 'lxml':
+      iterparse_records(chain, content)
+   else:
+      parse_xml(to_records(chain), content)
+
+def read_shards(fileName, size = SHARD_SIZE):
+   """Splits the decompressed dump into pieces of roughly the given size,
+   cut at top-level record boundaries.  Yields (header, piece) pairs, where
+   the header is the prolog with an absolute path to the DTD."""
+
+   boundary = re.compile('\n<(?:%s)[ >]' % '|'.join(TOPLEVEL))
    handle = gzip.open(fileName, 'r')
-   parse_xml(chain, handle)
+   buf = handle.read(size)
+   root = re.search('<dblp[^>]*>', buf)
+   header, buf = buf[:root.end()], buf[root.end():]
+   base = os.path.dirname(os.path.abspath(fileName))
+   header = re.sub('(<!DOCTYPE[^>]* SYSTEM ")([^"/:]*)"',
+      lambda m: '%s%s"' % (m.group(1), os.path.join(base, m.group(2))), header)
+
+   while True:
+      match = boundary.search(buf, size) if len(buf) > size else None
+      if match:
+         yield header, buf[:match.start() + 1]
+         buf = buf[match.start() + 1:]
+         continue
+      more = handle.read(size)
+      if not more:
+         break
+      buf += more
    handle.close()
 
+   end = buf.rfind('</dblp>')
+   if end >= 0:
+      buf = buf[:end]
+   yield header, buf
+
+def parse_shard(task):
+   """Extracts and filters the documents of a single shard.  Returns the state
+   of the filters (the most recent modification date and the documents seen
+   and dropped), the keys of changed documents and the records to store,
+   prepared by to_rows in batches of the given size."""
+
+   header, piece, fromDate, parser, batch = task
+   state, keys, records = {}, [], []
+   chain = filters(collect(records), state, fromDate, collect(keys))
+   parse_stream(chain, StringIO(header + piece + '</dblp>\n'), parser)
+   return state, keys, [to_rows(records[i:i + batch]) for i in xrange(0, len(records), batch)]
+
+def parse_records(conn, fileName, fromDate = None, parser = 'sax', jobs = 1, batch = BATCH_SIZE):
+   """Loads documents from the dump.  With fromDate given, only documents
+   modified on or after that date are re-ingested.  Returns a dict with the
+   most recent modification date found in the dump ('mdate'), the number of
+   documents seen ('seen'), the numbers dropped by reason ('dropped') and
+   the numbers of rows stored ('stored', 'authors' and 'authorships').
+
+   With jobs > 1 the shards are parsed in a pool of processes, but this
+   process still decompresses and splits the dump (a gzip stream cannot be
+   entered mid-way) and runs every insert.  That serial part bounds the
+   speedup, to about 4x on a synthetic dump, however many jobs there are."""
+
+   state = {}
+   changed = purge(conn)
+
+   if jobs <= 1:
+      target = store(conn, state, batch)
+      handle = gzip.open(fileName, 'r')
+      parse_stream(filters(target, state, fromDate, changed), handle, parser)
+      handle.close()
+      target.close()
+      return state
+
+   def consume(result):
+      shard, keys, batches = result
+      if shard.get('mdate') > state.get('mdate', ''):
+         state['mdate'] = shard['mdate']
+      merge_counts(state, shard)
+      for key in keys:
+         changed.send(key)
+      for rows in batches:
+         insert_rows(conn, state, rows)
+
+   # results are consumed in order, and at most a few shards are in flight
+   pool = multiprocessing.Pool(jobs)
+   pending = collections.deque()
+   for header, piece in read_shards(fileName):
+      pending.append(pool.apply_async(parse_shard, ((header, piece, fromDate, parser, batch),)))
+      if len(pending) >= 2 * jobs:
+         consume(pending.popleft().get())
+   while pending:
+      consume(pending.popleft().get())
+   pool.close()
+   pool.join()
+   return state
+
 def parse_venues(conn, fileName):
+   """Loads the names of venues.  Names are refreshed on every build, so
+   that venues renamed in dblp_bht.xml are renamed here too; a venue listed
+   more than once keeps its first name.  Returns a dict with the number of
+   venues seen ('seen'), the numbers dropped by reason ('dropped'), and the
+   number of venues added ('stored') and named or renamed ('named')."""
+
    handle = open(fileName, 'r')
+   state = {}
+   keys = set()
 
    for line in handle:
       match = re.match('<bht key="/db/(.*)/(.*)/index.bht" title="(.*)">', line.strip())
       if not match:
          continue
+      state['seen'] = state.get('seen', 0) + 1
       kind = match.group(1).strip()
       if kind not in KINDS:
+         drop(state, 'kind')
          continue
       acronym = match.group(2).strip()
       name = match.group(3).strip()
-      try:
-         conn.execute('INSERT INTO venue VALUES (?, ?, ?, ?)',
-            (kind + '/' + acronym, kind, acronym, name))
-      except sqlite3.IntegrityError:
-         pass
+      key = kind + '/' + acronym
+      if key in keys:
+         drop(state, 'duplicate')
+         continue
+      keys.add(key)
+      stored = conn.execute('INSERT OR IGNORE INTO venue (key, kind, acronym) VALUES (?, ?, ?)', (key, kind, acronym)).rowcount
+      named = conn.execute('UPDATE venue SET name = ? WHERE key = ? AND name IS NOT ?', (name, key, name)).rowcount
+      state['stored'] = state.get('stored', 0) + stored
+      state['named'] = state.get('named', 0) + named
 
    handle.close()
+   return state
+
+def count_rows(conn, stats):
+   """Records the size of the tables, and how many venues lack a name, and
+   so are left out of the TOC."""
+
+   for table in ['venue', 'record', 'author', 'authorship']:
+      stats.set('rows', conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0], table = table)
+   stats.set('venues_unnamed', conn.execute('SELECT COUNT(*) FROM venue WHERE name IS NULL').fetchone()[0])
 
 def create_tables(conn):
-   conn.execute('CREATE TABLE venue (key TEXT PRIMARY KEY, kind TEXT, acronym TEXT, name TEXT)')
-   conn.execute('CREATE TABLE record (title TEXT, authors TEXT, date TEXT, link TEXT, venue TEXT, year TEXT)')
-   conn.execute('CREATE INDEX byvenue ON record (venue)')
+   """Creates the tables.  Records refer to their venue by id, and to their
+   authors through authorship; dates are stored as YYYYMMDD integers and
+   normalized titles as their title_key."""
+
+   conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+   columns = [row[1] for row in conn.execute('PRAGMA table_info(venue)')]
+   if columns and 'id' not in columns:
+      # databases built before the schema was normalized held every field
+      # as text; the records are reloaded by a full build
+      conn.execute('DROP TABLE IF EXISTS record')
+      conn.execute('DROP TABLE venue')
+      conn.execute('DELETE FROM meta WHERE name = ?', ('mdate',))
+      conn.commit()
+      conn.execute('VACUUM')
+   conn.execute('CREATE TABLE IF NOT EXISTS venue (id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, kind TEXT, acronym TEXT, name TEXT)')
+   conn.execute('CREATE TABLE IF NOT EXISTS record (id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, title TEXT, date INTEGER, link TEXT, venue INTEGER, year INTEGER, norm INTEGER)')
+   conn.execute('CREATE TABLE IF NOT EXISTS author (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)')
+   conn.execute('CREATE TABLE IF NOT EXISTS authorship (record INTEGER, pos INTEGER, author INTEGER, PRIMARY KEY (record, pos)) WITHOUT ROWID')
+   try:
+      conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS titles USING fts5 (title, content = \'record\', content_rowid = \'id\', '
+         'tokenize = \'porter unicode61 remove_diacritics 2\')')
+   except sqlite3.OperationalError:
+      # SQLite built without FTS5: there are no keyword feeds
+      pass
+
+def has_titles(conn):
+   return conn.execute('SELECT COUNT(*) FROM sqlite_master WHERE name = ?', ('titles',)).fetchone()[0] > 0
+
+def create_indexes(conn):
+   """Creates the indexes.  The title index is rebuilt from scratch if its
+   triggers were not in place while records were loaded."""
+
+   for _, sql in INDEXES:
+      conn.execute(sql)
+   if not has_titles(conn):
+      return
+   names = [name for name, _ in TRIGGERS]
+   present = conn.execute('SELECT COUNT(*) FROM sqlite_master WHERE type = \'trigger\' AND name IN (%s)' % ', '.join('?' * len(names)), names).fetchone()[0]
+   if present < len(names):
+      conn.execute('INSERT INTO titles (titles) VALUES (\'rebuild\')')
+   for _, sql in TRIGGERS:
+      conn.execute(sql)
+
+def drop_indexes(conn):
+   """Drops the indexes on the record table, and the triggers maintaining
+   the title index, so that a full build does not have to update them for
+   every insert.  They are rebuilt afterwards by create_indexes."""
+
+   for name, _ in INDEXES:
+      conn.execute('DROP INDEX IF EXISTS %s' % name)
+   for name, _ in TRIGGERS:
+      conn.execute('DROP TRIGGER IF EXISTS %s' % name)
+
+def tune(conn):
+   """Sets pragmas suited to bulk loading.  The database is kept from one
+   build to the next, so every build, full or incremental, goes through a
+   write-ahead log: a build that is killed is rolled back rather than
+   leaving a corrupt file.  Syncing only at checkpoints cannot corrupt the
+   database either, at worst it loses the last build after a power cut."""
+
+   conn.execute('PRAGMA journal_mode = WAL')
+   conn.execute('PRAGMA synchronous = NORMAL')
+   conn.execute('PRAGMA cache_size = -%d' % CACHE_SIZE)
+
+def get_watermark(conn):
+   """Returns the modification date of the newest document ingested so far."""
+
+   row = conn.execute('SELECT value FROM meta WHERE name = ?', ('mdate',)).fetchone()
+   if not row:
+      return None
+   return datetime.datetime.strptime(row[0], '%Y-%m-%d')
+
+def set_watermark(conn, mdate):
+   conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('mdate', mdate))
+
+def bump_build(conn):
+   """Counts the builds that changed any record or venue.  calcTags only
+   trusts its stored counts, and the pipeline only skips the stages after
+   makeDB, while this has not moved: the watermark does not tell, as
+   records can change without a newer modification date."""
+
+   conn.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('build', '0'))
+   conn.execute('UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE name = ?', ('build',))
+
+def clear_watermark(conn):
+   """Forgets the watermark, so that the next build is a full one.  This is
+   committed before a full build starts reloading the records: if it does
+   not finish, an incremental build must not pick up from the old
+   watermark."""
+
+   conn.execute('DELETE FROM meta WHERE name = ?', ('mdate',))
+   conn.commit()
 
 if __name__ == "__main__":
    def usage():
-      print 'Usage: %s <dblp_bht.xml> <dblp.xml.gz> <index.sqlite>' % sys.argv[0]
-
-   if len(sys.argv) < 4:
+      print 'Usage: %s [-i] [-p sax|lxml] [-j <jobs>] [-b <batch>] [-m <metrics.prom>] <dblp_bht.xml> <dblp.xml.gz> <index.sqlite>' % sys.argv[0]
+      print '  -i  incremental: only ingest records changed since the previous build'
+      print '  -p  XML parser backend (default: sax)'
+      print '  -j  number of parser processes (default: 1); reading and storing stay serial'
+      print '  -b  number of records written per statement (default: %d)' % BATCH_SIZE
+      print '  -m  write metrics to this file, in the Prometheus text format'
+
+   try:
+      opts, args = getopt.getopt(sys.argv[1:], 'ip:j:b:m:')
+   except getopt.GetoptError:
+      usage()
+      sys.exit(1)
+   opts = dict(opts)
+   if len(args) < 3 or opts.get('-p', 'sax') not in PARSERS:
       usage()
       sys.exit(1)
+   incremental = '-i' in opts
+   parser = opts.get('-p', 'sax')
+   jobs = int(opts.get('-j', 1))
+   batch = int(opts.get('-b', BATCH_SIZE))
 
-   conn = sqlite3.connect(sys.argv[3])
+   stats = metrics.Metrics('makeDB')
+   conn = sqlite3.connect(args[2])
    create_tables(conn)
-   parse_venues(conn, sys.argv[1])
+   fromDate = None
+   if incremental:
+      fromDate = get_watermark(conn)
+   tune(conn)
+   changes = conn.total_changes
+   start = time.time()
+   venues = parse_venues(conn, args[0])
    conn.commit()
-   parse_records(conn, sys.argv[2])
+   stats.since('venues', start)
+   if fromDate:
+      create_indexes(conn)
+   else:
+      clear_watermark(conn)
+      drop_indexes(conn)
+      conn.execute('DELETE FROM authorship')
+      conn.execute('DELETE FROM author')
+      conn.execute('DELETE FROM record')
+   start = time.time()
+   state = parse_records(conn, args[1], fromDate, parser, jobs, batch)
+   elapsed = time.time() - start
+   stats.since('records', start)
+   print 'Stored %d records in %.1f s (%.0f rows/s)' % (state.get('stored', 0), elapsed, state.get('stored', 0) / max(elapsed, 1e-6))
+   start = time.time()
+   create_indexes(conn)
+   if state.get('mdate'):
+      set_watermark(conn, state['mdate'])
+   if conn.total_changes <> changes:
+      bump_build(conn)
    conn.commit()
+   stats.since('indexes', start)
+   if '-m' in opts:
+      for source, counts in [('bht', venues), ('dblp', state)]:
+         stats.set('records_seen', counts.get('seen', 0), source = source)
+         stats.set('records_kept', counts.get('seen', 0) - sum(counts.get('dropped', {}).values()), source = source)
+         stats.add_counts('records_dropped', counts.get('dropped', {}), 'reason', source = source)
+      stats.add_file('bytes_read', args[0])
+      stats.add_file('bytes_read', args[1])
+      stats.set('rows_written', venues.get('stored', 0) + state.get('venues', 0), table = 'venue')
+      for table, name in [('record', 'stored'), ('author', 'authors'), ('authorship', 'authorships')]:
+         stats.set('rows_written', state.get(name, 0), table = table)
+      count_rows(conn, stats)
+      stats.write(opts['-m'])
    conn.close()
 
 # vim:et:sw=3:ts=3
@@ -24,92 +24,475 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import cgi
+import collections
 import datetime
+import getopt
+import hashlib
+import itertools
 import json
+import multiprocessing
+import os
 import re
 import sqlite3
 import sys
+import time
+import urllib
+
+import metrics
+import precompress
+from makeDB import coroutine, has_titles
 
 CUTOFF_DAYS = 1000
 LIMIT = 200
+DATETIME_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+# venues per feed writing task
+BATCH_SIZE = 64
+
+def cutoff():
+   """Returns the oldest date and year of records that go into the feeds,
+   as stored in the database."""
+
+   fromDate = datetime.datetime.now() - datetime.timedelta(CUTOFF_DAYS)
+   return int(fromDate.strftime('%Y%m%d')), fromDate.year
+
+def toc_rows(conn):
+   """Yields the TOC entries (key, kind, acronym, name, count, id) straight
+   from the cursor, ordered by kind and name."""
+
+   fromDate, fromYear = cutoff()
+   for row in conn.execute('SELECT v.key, v.kind, v.acronym, v.name, COUNT(*), v.id FROM venue AS v JOIN record AS r ON r.venue = v.id WHERE r.date >= ? AND r.year >= ? AND v.name IS NOT NULL GROUP BY v.id ORDER BY v.kind, v.name', (fromDate, fromYear)):
+      yield row
 
 def calc_toc(conn):
-   fromDate = (datetime.datetime.now() - datetime.timedelta(CUTOFF_DAYS)).strftime('%Y-%m-%d')
-   fromYear = fromDate[0:4]
-   return [rec for rec in conn.execute('SELECT v.key, v.kind, v.acronym, v.name, COUNT(*) FROM venue AS v JOIN record AS r ON r.venue = v.key WHERE r.date >= ? AND r.year >= ? GROUP BY v.key ORDER BY v.kind, v.name', (fromDate, fromYear))]
+   return [row[:5] for row in toc_rows(conn)]
+
+def venue_items(conn, fromYear, venue):
+   """Returns the feed items of the newest LIMIT records of a venue, read
+   straight off the (venue, date) index, so that only those records are
+   visited.  There is a row per author, in order, which are joined here."""
+
+   rows = conn.execute('SELECT r.id, r.title, a.name, r.date, r.link, r.year FROM (SELECT id, title, date, link, year FROM record WHERE venue = ? AND year >= ? ORDER BY date DESC LIMIT ?) AS r JOIN authorship AS s ON s.record = r.id JOIN author AS a ON a.id = s.author ORDER BY r.date DESC, r.id, s.pos', (venue, fromYear, LIMIT))
+   return join_authors(rows)
+
+def join_authors(rows):
+   """Turns (id, title, author, date, link, year) rows, one per author of a
+   record, into (title, authors, date, link, year) feed items."""
+
+   items = []
+   for _, names in itertools.groupby(rows, lambda row: row[0]):
+      names = list(names)
+      _, title, _, date, link, year = names[0]
+      items.append((title, ', '.join(row[2] for row in names), date, link, year))
+   return items
+
+def query_items(conn, records, params):
+   """Returns the feed items of the newest LIMIT records selected by the
+   given query, which yields (id, title, date, link, year, pos) rows with pos
+   numbering them from the newest."""
+
+   rows = conn.execute('SELECT r.id, r.title, a.name, r.date, r.link, r.year FROM (SELECT * FROM (%s) WHERE pos <= ?) AS r JOIN authorship AS s ON s.record = r.id JOIN author AS a ON a.id = s.author ORDER BY r.pos, s.pos' % records, params + (LIMIT,))
+   return join_authors(rows)
+
+def author_items(conn, name, fromYear):
+   """Returns the feed items of an author, looked up in the author index."""
+
+   return query_items(conn, 'SELECT r.id, r.title, r.date, r.link, r.year, ROW_NUMBER() OVER (ORDER BY r.date DESC, r.id DESC) AS pos FROM author AS a JOIN authorship AS s ON s.author = a.id JOIN record AS r ON r.id = s.record WHERE a.name = ? AND r.year >= ?', (name, fromYear))
+
+def keyword_items(conn, keywords, fromYear):
+   """Returns the feed items of records with all the given words in their
+   titles, looked up in the full-text index."""
+
+   match = ' '.join('"%s"' % word.replace('"', '""') for word in keywords.split())
+   return query_items(conn, 'SELECT r.id, r.title, r.date, r.link, r.year, ROW_NUMBER() OVER (ORDER BY r.date DESC, r.id DESC) AS pos FROM titles JOIN record AS r ON r.id = titles.rowid WHERE titles MATCH ? AND r.year >= ?', (match, fromYear))
+
+def render_feed(title, description, link, items):
+   """Renders a feed, apart from its lastBuildDate.  Returns the lines
+   that go before and after it."""
+
+   head = []
+   head.append('<?xml version="1.0" encoding="UTF-8" ?>\n<rss version="2.0">\n<channel>\n')
+   head.append('  <title>%s</title>\n' % cgi.escape(title.encode('utf-8')))
+   head.append('  <description>%s</description>\n' % cgi.escape(description.encode('utf-8')))
+   head.append('  <link>%s</link>\n' % cgi.escape(link.encode('utf-8')))
 
-def update_feeds(toc, conn, feedsDirName):
-   DATETIME_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+   body = []
+   for title, authors, date, link, year in items:
+      title = cgi.escape(title.encode('utf-8'))
+      authors = cgi.escape(authors.encode('utf-8'))
+      link = cgi.escape(link.encode('utf-8'))
+
+      formattedDate = datetime.datetime.strptime(str(date), '%Y%m%d').strftime(DATETIME_FORMAT)
+
+      body.append('  <item>\n    <title>%s</title>\n' % title)
+      body.append('    <description>Published in %d. Authors: %s</description>\n' % (int(year), authors))
+      body.append('    <author>%s</author>\n' % authors)
+      body.append('    <link>%s</link>\n' % link)
+      body.append('    <guid>%s</guid>\n' % link)
+      body.append('    <pubDate>%s</pubDate>\n' % formattedDate)
+      body.append('  </item>\n\n')
+   body.append('</channel>\n</rss>\n')
+   return head, body
+
+def format_feed(head, body, now):
+   return '%s  <lastBuildDate>%s</lastBuildDate>\n\n%s' % (''.join(head), now, ''.join(body))
+
+def save_feed(fileName, head, body, now, fingerprint = None):
+   """Writes a rendered feed.  The file is left alone if the feed, apart
+   from lastBuildDate, matches the given fingerprint; otherwise it is
+   replaced atomically.  Returns the new fingerprint, and whether the file
+   was written."""
+
+   digest = hashlib.md5(''.join(head + body)).hexdigest()
+   if digest == fingerprint and os.path.exists(fileName):
+      return digest, False
+
+   handle = open(fileName + '.tmp', 'w')
+   handle.write(format_feed(head, body, now))
+   handle.close()
+   os.rename(fileName + '.tmp', fileName)
+   return digest, True
+
+def venue_feed(entry, items):
+   """Renders the feed of a venue, given its TOC entry."""
+
+   key, kind, acronym, name = entry[:4]
+   fullKind = ['conference', 'journal'][kind == 'journals']
+   return render_feed(name, u'Feed for DBLP-indexed %s %s' % (fullKind, name),
+      u'http://dblp.uni-trier.de/db/%s/index.html' % key, items)
+
+def query_feed(kind, query, items):
+   """Renders the feed of an author or keywords (kind is 'authors' or
+   'keywords')."""
+
+   _, description, link = QUERIES[kind]
+   return render_feed(query, description % query, link % urllib.quote_plus(query.encode('utf-8')), items)
+
+def write_feed(entry, items, now, feedsDirName, fingerprint = None):
+   """Writes the feed of a venue.  Returns what save_feed returns."""
+
+   # print 'Building feed for %s' % entry[0]
+   sanitizedKey = re.sub('[^a-zA-Z0-9_/-]', '', entry[0])
+   head, body = venue_feed(entry, items)
+   return save_feed(feedsDirName + '/' + sanitizedKey + '.xml', head, body, now, fingerprint)
+
+def write_feeds(conn, entries, fingerprints, now, fromYear, feedsDirName):
+   """Writes the feeds of the given TOC entries.  Returns (venue key,
+   fingerprint, number of items, whether the file was written) tuples."""
+
+   written = []
+   for entry in entries:
+      items = venue_items(conn, fromYear, entry[5])
+      fingerprint, changed = write_feed(entry, items, now, feedsDirName, fingerprints.get(entry[0]))
+      written.append((entry[0], fingerprint, len(items), changed))
+   return written
+
+def write_shard(task):
+   """Writes the feeds of a shard of venues, using its own read-only
+   connection."""
+
+   dbFileName, entries, fingerprints, now, fromYear, feedsDirName = task
+   conn = sqlite3.connect(dbFileName)
+   conn.execute('PRAGMA query_only = ON')
+   written = write_feeds(conn, entries, fingerprints, now, fromYear, feedsDirName)
+   conn.close()
+   return written
+
+def batches(entries, size = BATCH_SIZE):
+   entries = iter(entries)
+   while True:
+      batch = list(itertools.islice(entries, size))
+      if not batch:
+         break
+      yield batch
+
+def fingerprints_of(conn, entries):
+   keys = [entry[0] for entry in entries]
+   return dict(conn.execute('SELECT venue, fingerprint FROM feed WHERE venue IN (%s)' % ', '.join('?' * len(keys)), keys))
+
+def update_feeds(toc, conn, feedsDirName, jobs = 1, target = None):
+   """Writes the feeds of the TOC entries (see toc_rows) in one pass, in
+   batches, in a pool of processes if jobs > 1.  Each entry is then sent on
+   to target, in TOC order, so that the TOC can come straight from a cursor
+   and also feed the index writers.  Returns a dict with the numbers of
+   feeds and items ('feeds' and 'items'), and of feed files written
+   ('written')."""
 
    now = datetime.datetime.utcnow().strftime(DATETIME_FORMAT)
-   fromDate = (datetime.datetime.now() - datetime.timedelta(CUTOFF_DAYS)).strftime('%Y-%m-%d')
-   fromYear = fromDate[0:4]
+   _, fromYear = cutoff()
 
-   for key, kind, acronym, name, _ in toc:
-      # print 'Building feed for %s' % key
-      sanitizedKey = re.sub('[^a-zA-Z0-9_/-]', '', key)
-      fullKind = ['conference', 'journal'][kind == 'journals']
-      handle = open(feedsDirName + '/' + sanitizedKey + '.xml', 'w')
+   # before reading the TOC: a commit would reset its cursor
+   create_tables(conn)
+   written = []
+   state = {'feeds': 0, 'items': 0, 'written': 0}
 
-      name = cgi.escape(name.encode('utf-8'))
+   def consume(entries, result):
+      for key, fingerprint, items, changed in result:
+         written.append((key, fingerprint))
+         state['feeds'] += 1
+         state['items'] += items
+         state['written'] += changed
+      if target <> None:
+         for entry in entries:
+            target.send(entry)
 
-      handle.write('<?xml version="1.0" encoding="UTF-8" ?>\n<rss version="2.0">\n<channel>\n')
-      handle.write('  <title>%s</title>\n' % name)
-      handle.write('  <description>Feed for DBLP-indexed %s %s</description>\n' % (fullKind, name))
-      handle.write('  <link>http://dblp.uni-trier.de/db/%s/index.html</link>\n' % key)
-      handle.write('  <lastBuildDate>%s</lastBuildDate>\n\n' % now)
+   if jobs <= 1:
+      for entries in batches(toc):
+         consume(entries, write_feeds(conn, entries, fingerprints_of(conn, entries), now, fromYear, feedsDirName))
+   else:
+      # results are consumed in order, and at most a few batches are in flight
+      dbFileName = conn.execute('PRAGMA database_list').fetchone()[2]
+      pool = multiprocessing.Pool(jobs)
+      pending = collections.deque()
+      for entries in batches(toc):
+         task = (dbFileName, entries, fingerprints_of(conn, entries), now, fromYear, feedsDirName)
+         pending.append((entries, pool.apply_async(write_shard, (task,))))
+         if len(pending) >= 2 * jobs:
+            entries, result = pending.popleft()
+            consume(entries, result.get())
+      while pending:
+         entries, result = pending.popleft()
+         consume(entries, result.get())
+      pool.close()
+      pool.join()
 
-      for title, authors, date, link, _, year \
-         in conn.execute('SELECT * FROM record WHERE venue = ? AND year >= ? ORDER BY date DESC LIMIT ?', (key, fromYear, LIMIT)):
+   conn.executemany('INSERT OR REPLACE INTO feed VALUES (?, ?)', written)
+   conn.commit()
+   return state
 
-         title = cgi.escape(title.encode('utf-8'))
-         authors = cgi.escape(authors.encode('utf-8'))
-         link = cgi.escape(link.encode('utf-8'))
+def slug(text):
+   """Turns an author name or keywords into a file name, made unique by a
+   short hash."""
 
-         formattedDate = datetime.datetime.strptime(date, '%Y-%m-%d').strftime(DATETIME_FORMAT)
+   text = text.encode('utf-8')
+   return '%s-%s' % (re.sub('[^a-zA-Z0-9]+', '_', text).strip('_'), hashlib.md5(text).hexdigest()[:8])
 
-         handle.write('  <item>\n    <title>%s</title>\n' % title)
-         handle.write('    <description>Published in %d. Authors: %s</description>\n' % (int(year), authors))
-         handle.write('    <author>%s</author>\n' % authors)
-         handle.write('    <link>%s</link>\n' % link)
-         handle.write('    <guid>%s</guid>\n' % link)
-         handle.write('    <pubDate>%s</pubDate>\n' % formattedDate)
-         handle.write('  </item>\n\n')
+# per kind of query feed: the function finding its items, and the
+# description and DBLP link of the feed
+QUERIES = {
+   'authors': (author_items, u'Feed for DBLP-indexed papers by %s', u'http://dblp.uni-trier.de/search/author?author=%s'),
+   'keywords': (keyword_items, u'Feed for DBLP-indexed papers on %s', u'http://dblp.uni-trier.de/search/publ?q=%s'),
+}
 
-      handle.write('</channel>\n</rss>\n')
-      handle.close()
+def update_query_feeds(conn, kind, queries, feedsDirName):
+   """Writes the feeds of the given authors or keywords (kind is 'authors'
+   or 'keywords') into a subdirectory of feedsDirName named after the kind.
+   Each feed takes time proportional to its number of records.  Returns a
+   dict with the numbers of feeds and items ('feeds' and 'items'), of feed
+   files written ('written') and of empty feeds ('empty')."""
+
+   now = datetime.datetime.utcnow().strftime(DATETIME_FORMAT)
+   _, fromYear = cutoff()
+   items = QUERIES[kind][0]
+   if not os.path.isdir(os.path.join(feedsDirName, kind)):
+      os.makedirs(os.path.join(feedsDirName, kind))
+
+   create_tables(conn)
+   written = []
+   state = {'feeds': 0, 'items': 0, 'written': 0, 'empty': 0}
+   for query in queries:
+      key = '%s:%s' % (kind, query)
+      fingerprint = conn.execute('SELECT fingerprint FROM feed WHERE venue = ?', (key,)).fetchone()
+      fingerprint = fingerprint and fingerprint[0]
+      found = items(conn, query, fromYear)
+      head, body = query_feed(kind, query, found)
+      fingerprint, changed = save_feed(os.path.join(feedsDirName, kind, slug(query) + '.xml'), head, body, now, fingerprint)
+      written.append((key, fingerprint))
+      state['feeds'] += 1
+      state['items'] += len(found)
+      state['written'] += changed
+      state['empty'] += not found
+   conn.executemany('INSERT OR REPLACE INTO feed VALUES (?, ?)', written)
+   conn.commit()
+   return state
+
+def read_queries(fileName):
+   """Reads authors or keywords, one per line."""
+
+   handle = open(fileName, 'r')
+   queries = [line.decode('utf-8').strip() for line in handle]
+   handle.close()
+   return [query for query in queries if query]
+
+def create_tables(conn):
+   # fingerprints of the feeds, keyed by venue, or by kind and query
+   conn.execute('CREATE TABLE IF NOT EXISTS feed (venue TEXT PRIMARY KEY, fingerprint TEXT)')
+   conn.commit()
+
+@coroutine
+def broadcast(targets):
+   while True:
+      item = (yield)
+      for target in targets:
+         target.send(item)
+
+@coroutine
+def write_index(handle):
+   """Writes the TOC entries it receives, ordered by kind, as the HTML
+   index, with a section per kind.  The file is finished when the coroutine
+   is closed."""
 
-def update_index(toc, htmlFileName):
-   handle = open(htmlFileName, 'w')
    headings = {'conf': 'Conferences', 'journals': 'Journals'}
-   for turn in ['conf', 'journals']:
-      handle.write('<div class="%s">\n<h2>%s</h2>\n' % (turn, headings[turn]))
-      for key, kind, acronym, name, count in toc:
-         if kind <> turn:
+   turns = ['conf', 'journals']
+   opened = []
+   try:
+      while True:
+         key, kind, acronym, name, count = (yield)[:5]
+         if kind not in turns:
             continue
+         if kind in opened[:-1]:
+            raise ValueError, 'TOC not ordered by kind'
+         while opened[-1:] <> [kind]:
+            if opened:
+               handle.write('</div>\n')
+            opened.append(turns[len(opened)])
+            handle.write('<div class="%s">\n<h2>%s</h2>\n' % (opened[-1], headings[opened[-1]]))
          sanitizedKey = re.sub('[^a-zA-Z0-9_/-]', '', key)
          handle.write('<div class="entry"><a href="%s.xml">%s</a> <span class="count">%d</span></div>\n' % (sanitizedKey, name.encode('utf-8'), min(count, LIMIT)))
-      handle.write('</div>\n')
-   handle.close()
+   except GeneratorExit:
+      if opened:
+         handle.write('</div>\n')
+      for turn in turns[len(opened):]:
+         handle.write('<div class="%s">\n<h2>%s</h2>\n</div>\n' % (turn, headings[turn]))
+      handle.close()
+
+@coroutine
+def write_json(handle):
+   """Writes the TOC entries it receives as a JSON list, as json.dump
+   would, without holding them.  The file is finished when the coroutine is
+   closed."""
+
+   handle.write('[')
+   separator = ''
+   try:
+      while True:
+         handle.write(separator + json.dumps((yield)[:5]))
+         separator = ', '
+   except GeneratorExit:
+      handle.write(']')
+      handle.close()
+
+def page_name(jsonFileName, page):
+   return '%s.%s.json' % (os.path.splitext(jsonFileName)[0], page)
+
+@coroutine
+def write_pages(jsonFileName, size, written):
+   """Splits the TOC entries it receives into pages of the given size,
+   index.1.json, index.2.json and so on next to index.json, so that a client
+   can fetch only what it shows.  When the coroutine is closed, pages left
+   over from a longer TOC are removed, and index.pages.json is written: the
+   number of entries, the page size and the key of the first entry of every
+   page.  The names of the files written are appended to written."""
+
+   count, firsts, page = 0, [], None
+   try:
+      while True:
+         entry = (yield)
+         if count % size == 0:
+            if page <> None:
+               page.close()
+            firsts.append(entry[0])
+            written.append(page_name(jsonFileName, len(firsts)))
+            page = write_json(open(written[-1], 'w'))
+         page.send(entry)
+         count += 1
+   except GeneratorExit:
+      if page <> None:
+         page.close()
+      stale = len(firsts) + 1
+      while os.path.exists(page_name(jsonFileName, stale)):
+         for suffix in ['', '.gz', '.br']:
+            if os.path.exists(page_name(jsonFileName, stale) + suffix):
+               os.remove(page_name(jsonFileName, stale) + suffix)
+         stale += 1
+      written.append(page_name(jsonFileName, 'pages'))
+      handle = open(written[-1], 'w')
+      json.dump({'entries': count, 'size': size, 'first': firsts}, handle)
+      handle.close()
+
+def update_index(toc, htmlFileName):
+   target = write_index(open(htmlFileName, 'w'))
+   for entry in toc:
+      target.send(entry)
+   target.close()
 
 def update_json(toc, jsonFileName):
-   handle = open(jsonFileName, 'w')
-   json.dump(toc, handle)
-   handle.close()
+   target = write_json(open(jsonFileName, 'w'))
+   for entry in toc:
+      target.send(entry)
+   target.close()
+
+def update_files(conn, feedsDirName, htmlFileName, jsonFileName, jobs = 1, pageSize = None):
+   """Writes the feeds, the HTML index and index.json, and with pageSize
+   given the pages of index.json, in a single pass over the TOC.  Returns
+   the names of the index files written, and what update_feeds returns."""
+
+   written = [htmlFileName, jsonFileName]
+   targets = [write_index(open(htmlFileName, 'w')), write_json(open(jsonFileName, 'w'))]
+   if pageSize:
+      targets.append(write_pages(jsonFileName, pageSize, written))
+   state = update_feeds(toc_rows(conn), conn, feedsDirName, jobs, broadcast(targets))
+   for target in targets:
+      target.close()
+   return written, state
+
+def feed_metrics(stats, kind, state):
+   stats.set('feeds', state['written'], kind = kind, state = 'written')
+   stats.set('feeds', state['feeds'] - state['written'], kind = kind, state = 'unchanged')
+   if 'empty' in state:
+      stats.set('feeds', state['empty'], kind = kind, state = 'empty')
+   stats.set('feed_items', state['items'], kind = kind)
 
 if __name__ == "__main__":
    def usage():
-      print 'Usage: %s <index.sqlite> <feeds_dir> <index.html.part> <index.json>' % sys.argv[0]
+      print 'Usage: %s [-j <jobs>] [-p <entries>] [-m <metrics.prom>] [-a <authors>] [-k <keywords>] [-z] <index.sqlite> <feeds_dir> <index.html.part> <index.json>' % sys.argv[0]
+      print '  -j, --jobs      number of feed writer processes (default: 1)'
+      print '  -p, --pages     also split index.json into pages of this many entries'
+      print '  -m, --metrics   write metrics to this file, in the Prometheus text format'
+      print '  -a, --authors   also write feeds of the authors listed in this file, one per line'
+      print '  -k, --keywords  also write feeds of title keywords listed in this file, one query per line'
+      print '  -z, --compress  also write compressed siblings of the files, for static serving (see precompress.py)'
 
-   if len(sys.argv) < 5:
+   try:
+      opts, args = getopt.getopt(sys.argv[1:], 'j:p:a:k:zm:', ['jobs=', 'pages=', 'authors=', 'keywords=', 'compress', 'metrics='])
+   except getopt.GetoptError:
+      usage()
+      sys.exit(1)
+   opts = dict(opts)
+   if len(args) < 4:
       usage()
       sys.exit(1)
+   jobs = int(opts.get('-j', opts.get('--jobs', 1)))
+   pageSize = int(opts.get('-p', opts.get('--pages', 0)))
+
+   metricsFileName = opts.get('-m', opts.get('--metrics'))
 
-   conn = sqlite3.connect(sys.argv[1])
-   toc = calc_toc(conn)
-   update_feeds(toc, conn, sys.argv[2])
-   update_index(toc, sys.argv[3])
-   update_json(toc, sys.argv[4])
+   stats = metrics.Metrics('makeFiles')
+   conn = sqlite3.connect(args[0])
+   start = time.time()
+   written, state = update_files(conn, args[1], args[2], args[3], jobs, pageSize)
+   stats.since('venues', start)
+   feed_metrics(stats, 'venues', state)
+   for kind in QUERIES:
+      fileName = opts.get('-' + kind[0], opts.get('--' + kind))
+      if fileName and kind == 'keywords' and not has_titles(conn):
+         # makeDB skips the title index if SQLite lacks FTS5
+         print >> sys.stderr, 'No title index in %s, skipping the keyword feeds' % args[0]
+         continue
+      if fileName:
+         start = time.time()
+         feed_metrics(stats, kind, update_query_feeds(conn, kind, read_queries(fileName), args[1]))
+         stats.since(kind, start)
    conn.close()
+   if '-z' in opts or '--compress' in opts:
+      # feeds left alone keep their mtime, and so their siblings
+      start = time.time()
+      precompress.update_tree(args[1])
+      for fileName in written:
+         precompress.update(fileName)
+      stats.since('compress', start)
+   if metricsFileName:
+      for fileName in written:
+         stats.add_file('bytes_written', fileName)
+      stats.write(metricsFileName)
 
 # vim:et:sw=3:ts=3
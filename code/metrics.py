@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012-2013 Lukasz Bolikowski
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import re
+import time
+
+PREFIX = 'dblpfeeds'
+# every metric, in the order they are written, with its help text; they are
+# all gauges, as each build writes what it measured in its own run
+METRICS = [
+   ('records_seen', 'Records read from the input in the last run.'),
+   ('records_kept', 'Records that passed every filter in the last run.'),
+   ('records_dropped', 'Records discarded in the last run, by reason.'),
+   ('bytes_read', 'Bytes of input read in the last run, by file.'),
+   ('rows_written', 'Rows inserted in the last run, by table.'),
+   ('rows', 'Rows in the database after the last run, by table.'),
+   ('venues_unnamed', 'Venues without a name, which are left out of the TOC.'),
+   ('chunks', 'arXiv chunks on disk in the last run, by state.'),
+   ('feeds', 'Feeds in the last run, by kind and state.'),
+   ('feed_items', 'Items in the feeds of the last run, by kind.'),
+   ('bytes_written', 'Bytes of index files written in the last run, by file.'),
+   ('duration_seconds', 'Time taken by the last run, by stage.'),
+   ('last_success_timestamp_seconds', 'Time the last successful run finished.'),
+]
+HELP = dict(METRICS)
+
+SAMPLE = re.compile('^%s_([a-z_]+)\\{(.*)\\} (\\S+)$' % PREFIX)
+LABEL = re.compile('([a-z_]+)="((?:[^"\\\\]|\\\\.)*)"')
+
+def format_value(value):
+   if isinstance(value, float):
+      return repr(value)
+   return '%d' % value
+
+def unescape(text):
+   return re.sub(r'\\(.)', lambda m: {'n': '\n'}.get(m.group(1), m.group(1)), text)
+
+def escape(value):
+   return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class Metrics:
+   """What a build script measured, written in the Prometheus text
+   format for the textfile collector of node_exporter.  Samples are keyed
+   by metric name and labels; every sample also gets a script label (not
+   job, which Prometheus sets on every scraped sample itself)."""
+
+   def __init__(self, script):
+      self.script = script
+      self.samples = {}
+      self.started = time.time()
+
+   def key(self, name, labels):
+      if name not in HELP:
+         raise KeyError, 'Unknown metric %s' % name
+      return name, tuple(sorted(labels.items()))
+
+   def set(self, name, value, **labels):
+      self.samples[self.key(name, labels)] = value
+
+   def add(self, name, value, **labels):
+      key = self.key(name, labels)
+      self.samples[key] = self.samples.get(key, 0) + value
+
+   def add_counts(self, name, counts, label, **labels):
+      """Adds a dict of counts, e.g. by reason, under the given label."""
+
+      for value, count in counts.iteritems():
+         labels[label] = value
+         self.add(name, count, **labels)
+
+   def since(self, stage, start):
+      """Records the time taken by a stage begun at start."""
+
+      self.set('duration_seconds', time.time() - start, stage = stage)
+
+   def add_file(self, name, fileName):
+      """Records the size of a file read or written."""
+
+      self.add(name, os.path.getsize(fileName), file = os.path.basename(fileName))
+
+   def render(self):
+      lines = []
+      for name, help in METRICS:
+         samples = sorted((labels, value) for (sampleName, labels), value in self.samples.iteritems() if sampleName == name)
+         if not samples:
+            continue
+         lines.append('# HELP %s_%s %s' % (PREFIX, name, help))
+         lines.append('# TYPE %s_%s gauge' % (PREFIX, name))
+         for labels, value in samples:
+            labels = (('script', self.script),) + labels
+            lines.append('%s_%s{%s} %s' % (PREFIX, name,
+               ','.join('%s="%s"' % (label, escape(text)) for label, text in labels), format_value(value)))
+      return '\n'.join(lines) + '\n'
+
+   def write(self, fileName):
+      """Writes the metrics, with the total duration and the time of this
+      successful run.  The file is replaced atomically, so that the
+      collector never reads half of it."""
+
+      self.since('total', self.started)
+      self.set('last_success_timestamp_seconds', time.time())
+      handle = open(fileName + '.tmp', 'w')
+      handle.write(self.render())
+      handle.close()
+      os.rename(fileName + '.tmp', fileName)
+
+def read(fileName):
+   """Reads back the samples of a file written by Metrics.write, as a dict
+   keyed like Metrics.samples: by metric name, and by the labels apart
+   from script."""
+
+   samples = {}
+   handle = open(fileName, 'r')
+   for line in handle:
+      match = SAMPLE.match(line.strip())
+      if not match:
+         continue
+      labels = tuple(sorted((label, unescape(text)) for label, text in LABEL.findall(match.group(2)) if label <> 'script'))
+      value = match.group(3)
+      samples[match.group(1), labels] = float(value) if re.search('[.eE]', value) else int(value)
+   handle.close()
+   return samples
+
+# vim:et:sw=3:ts=3
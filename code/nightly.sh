@@ -33,15 +33,24 @@ DB=$TMP/dblp.sqlite
 DUMP=$TMP/dblp.xml.gz
 JSON=$TMP/index.json
 HTML=$TMP/index.html.part
+# read by the textfile collector of node_exporter
+METRICS=$TMP/metrics
+
+mkdir -p $METRICS
 
 rm -f $TMP/dblp-*.xml.gz
 wget http://dblp.uni-trier.de/xml/dblp.xml.gz -O $DUMP
-rm -f $DB
-python $CODE/makeDB.py $BHT $DUMP $DB
-rm -rf $TMP/conf $TMP/journals $JSON $HTML
-mkdir -p $TMP/conf $TMP/journals
-python $CODE/makeFiles.py $DB $TMP $HTML $JSON
-cp -r $TMP/conf $TMP/journals $WWW/
+# records deleted from the dump are only dropped by a full build, which
+# runs once a week
+INCREMENTAL=-i
+if [ `date +%u` = 7 ]; then
+   INCREMENTAL=
+fi
+python $CODE/makeDB.py $INCREMENTAL -m $METRICS/makeDB.prom $BHT $DUMP $DB
+rm -f $JSON $HTML
+mkdir -p $WWW/conf $WWW/journals
+python $CODE/makeFiles.py -z -m $METRICS/makeFiles.prom $DB $WWW $HTML $JSON
 cp $JSON $WWW/
 cat $CODE/index.html.template | sed -e "/#########/r $HTML" > $WWW/index.html
+python $CODE/precompress.py $WWW/index.json $WWW/index.html
 
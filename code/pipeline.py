@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012-2013 Lukasz Bolikowski
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+import getopt
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import chunkPack
+import makeFiles
+import metrics
+import precompress
+
+CODE = os.path.dirname(os.path.abspath(__file__))
+STATE = 'pipeline.json'
+
+class Paths:
+   def __init__(self, tmpDir, wwwDir):
+      self.bht = os.path.join(tmpDir, 'dblp_bht.xml')
+      self.dump = os.path.join(tmpDir, 'dblp.xml.gz')
+      self.db = os.path.join(tmpDir, 'dblp.sqlite')
+      self.chunks = os.path.join(tmpDir, 'arXiv')
+      self.html = os.path.join(tmpDir, 'index.html.part')
+      self.json = os.path.join(tmpDir, 'index.json')
+      self.opml = os.path.join(tmpDir, 'opml')
+      self.state = os.path.join(tmpDir, STATE)
+      self.www = wwwDir
+
+def makeDirs(path):
+   if not os.path.isdir(path):
+      os.makedirs(path)
+
+def query(paths, sql):
+   """Runs a query returning one value, or None if the table is not there."""
+
+   if not os.path.exists(paths.db):
+      return None
+   conn = sqlite3.connect(paths.db)
+   try:
+      return conn.execute(sql).fetchone()[0]
+   except sqlite3.OperationalError:
+      return None
+   finally:
+      conn.close()
+
+def file_key(*fileNames):
+   return [(f, os.path.getsize(f), os.path.getmtime(f)) for f in fileNames if os.path.exists(f)]
+
+def chunks_key(chunksDir):
+   key = []
+   for root, dirs, files in os.walk(chunksDir):
+      for name in sorted(files):
+         if name.endswith(chunkPack.INDEX) or name.endswith('.xml') or name.endswith('.xml.gz'):
+            key += file_key(os.path.join(root, name))
+   return key
+
+def records_key(paths):
+   """Identifies the loaded DBLP records.  Every stage writes to the same
+   database, so its mtime says nothing; the build counter makeDB moves
+   whenever it changes a row does (see makeDB.bump_build)."""
+
+   return query(paths, "SELECT value FROM meta WHERE name = 'build'")
+
+def tags_key(paths):
+   if not os.path.exists(paths.db):
+      return None
+   conn = sqlite3.connect(paths.db)
+   try:
+      return hashlib.md5(repr(sorted(conn.execute('SELECT venue, tag FROM tags')))).hexdigest()
+   except sqlite3.OperationalError:
+      return None
+   finally:
+      conn.close()
+
+def sample(samples, name, **labels):
+   """Looks up a value in the metrics a stage wrote (see metrics.read)."""
+
+   return samples.get((name, tuple(sorted(labels.items()))))
+
+def python(script, *args):
+   return [sys.executable, os.path.join(CODE, script)] + list(args)
+
+def build_index(paths, compress = False):
+   """Publishes index.json and splices the TOC into index.html."""
+
+   shutil.copy(paths.json, os.path.join(paths.www, 'index.json'))
+   template = open(os.path.join(CODE, 'index.html.template'), 'r')
+   part = open(paths.html, 'r').read()
+   handle = open(os.path.join(paths.www, 'index.html'), 'w')
+   for line in template:
+      handle.write(line)
+      if '#########' in line:
+         handle.write(part)
+   handle.close()
+   template.close()
+   if compress:
+      precompress.update(os.path.join(paths.www, 'index.json'))
+      precompress.update(os.path.join(paths.www, 'index.html'))
+
+def publish_opml(paths):
+   target = os.path.join(paths.www, 'opml')
+   if os.path.isdir(target):
+      shutil.rmtree(target)
+   os.rename(paths.opml, target)
+
+def prepare_opml(paths):
+   if os.path.isdir(paths.opml):
+      shutil.rmtree(paths.opml)
+   os.makedirs(paths.opml)
+
+def stages(paths, jobs, compress = False, incremental = False):
+   """The stages in dependency order.  Each has a command, a function that
+   computes a key of its inputs (the stage is skipped if the key is the same
+   as after its last successful run), and functions counting its records in
+   and out.  Stages with metrics set are run with -m, and their counts are
+   taken from the metrics they wrote, so that they are what the stage
+   processed in this run.  With compress set, the files published get
+   compressed siblings.  makeDB only ingests the records changed since its
+   previous build with incremental set, and otherwise reloads them all,
+   which also drops the records deleted from DBLP."""
+
+   j = str(jobs)
+   z = ['-z'] * compress
+   i = ['-i'] * incremental
+   return [
+      {'name': 'makeDB',
+       'command': python('makeDB.py', *(i + ['-j', j, paths.bht, paths.dump, paths.db])),
+       'key': lambda: file_key(paths.bht, paths.dump),
+       'metrics': True,
+       'in': lambda samples: sample(samples, 'records_seen', source = 'dblp'),
+       'out': lambda samples: sample(samples, 'records_kept', source = 'dblp')},
+      {'name': 'calcTags',
+       'command': python('calcTags.py', '-j', j, paths.db, paths.chunks),
+       'key': lambda: [chunks_key(paths.chunks), records_key(paths)],
+       'metrics': True,
+       'in': lambda samples: sample(samples, 'records_seen', source = 'arxiv'),
+       'out': lambda samples: sample(samples, 'rows_written', table = 'tags')},
+      {'name': 'makeFiles',
+       'command': python('makeFiles.py', '-j', j, *(z + [paths.db, paths.www, paths.html, paths.json])),
+       'before': lambda: [makeDirs(os.path.join(paths.www, kind)) for kind in ['conf', 'journals']],
+       'after': lambda: build_index(paths, compress),
+       # the cutoff moves every day
+       'key': lambda: [records_key(paths), datetime.date.today().isoformat(), makeFiles.CUTOFF_DAYS, makeFiles.LIMIT, compress],
+       'metrics': True,
+       'in': lambda samples: sample(samples, 'feeds', kind = 'venues', state = 'written') + sample(samples, 'feeds', kind = 'venues', state = 'unchanged'),
+       'out': lambda samples: sample(samples, 'feeds', kind = 'venues', state = 'written')},
+      {'name': 'writeOPML',
+       'command': python('writeOPML.py', *(z + [paths.db, paths.opml])),
+       'before': lambda: prepare_opml(paths),
+       'after': lambda: publish_opml(paths),
+       'key': lambda: [tags_key(paths), query(paths, 'SELECT COUNT(*) FROM venue'), compress],
+       'in': lambda samples: query(paths, 'SELECT COUNT(*) FROM tags'),
+       'out': lambda samples: len([n for n in os.listdir(os.path.join(paths.www, 'opml')) if n.endswith('.opml')])},
+   ]
+
+def run_stage(stage, runDir, profile):
+   """Runs a stage in a child process.  Returns its metrics."""
+
+   command = stage['command']
+   metricsFileName = os.path.join(runDir, stage['name'] + '.prom')
+   if stage.get('metrics'):
+      command = command[:2] + ['-m', metricsFileName] + command[2:]
+   if profile:
+      command = command[:1] + ['-m', 'cProfile', '-o', os.path.join(runDir, stage['name'] + '.prof')] + command[1:]
+   log = open(os.path.join(runDir, stage['name'] + '.log'), 'w')
+   if 'before' in stage:
+      stage['before']()
+   start = time.time()
+   child = subprocess.Popen(command, stdout = log, stderr = subprocess.STDOUT)
+   # wait4 gives the resource usage of this child alone
+   _, status, usage = os.wait4(child.pid, 0)
+   child.returncode = status
+   wall = time.time() - start
+   log.close()
+   if status <> 0:
+      raise RuntimeError, '%s failed, see %s' % (stage['name'], log.name)
+   if 'after' in stage:
+      stage['after']()
+   samples = {}
+   if stage.get('metrics'):
+      samples = metrics.read(metricsFileName)
+   return {'wall': wall, 'cpu': usage.ru_utime + usage.ru_stime, 'maxrss': usage.ru_maxrss,
+      'in': stage['in'](samples), 'out': stage['out'](samples)}
+
+def run(paths, runsDir, jobs = 1, profile = False, force = False, compress = False, incremental = False):
+   """Runs the stages whose inputs changed.  Metrics of every stage, and
+   with profile set a cProfile dump of every stage that ran, go to a new
+   run directory under runsDir."""
+
+   if profile:
+      # cProfile sees only the main process, and pool workers cannot
+      # unpickle functions from a script run under it
+      jobs = 1
+   # named after the time, for sorting, and unique even within a second
+   makeDirs(runsDir)
+   runDir = tempfile.mkdtemp(prefix = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-'), dir = runsDir)
+   os.chmod(runDir, 0755)
+   keys = {}
+   if os.path.exists(paths.state):
+      keys = json.load(open(paths.state, 'r'))
+
+   report = []
+   for stage in stages(paths, jobs, compress, incremental):
+      key = json.loads(json.dumps(stage['key']()))
+      if not force and keys.get(stage['name']) == key:
+         metrics = {'skipped': True}
+      else:
+         metrics = run_stage(stage, runDir, profile)
+         # keys are taken after the stage, as its own output may be its input
+         keys[stage['name']] = json.loads(json.dumps(stage['key']()))
+         handle = open(paths.state + '.tmp', 'w')
+         json.dump(keys, handle)
+         handle.close()
+         os.rename(paths.state + '.tmp', paths.state)
+      metrics['stage'] = stage['name']
+      report.append(metrics)
+
+   handle = open(os.path.join(runDir, 'stages.json'), 'w')
+   json.dump(report, handle, indent = 1)
+   handle.close()
+   return runDir, report
+
+def print_report(report):
+   print '%-10s %10s %10s %12s %12s %12s' % ('stage', 'wall s', 'cpu s', 'peak RSS kB', 'in', 'out')
+   for m in report:
+      if m.get('skipped'):
+         print '%-10s %10s' % (m['stage'], 'skipped')
+         continue
+      print '%-10s %10.1f %10.1f %12d %12s %12s' % (m['stage'], m['wall'], m['cpu'], m['maxrss'], m['in'], m['out'])
+
+if __name__ == "__main__":
+   def usage():
+      print 'Usage: %s [-i] [-j <jobs>] [-p] [-f] [-z] [-r <runs_dir>] <tmp_dir> <www_dir>' % sys.argv[0]
+      print '  runs makeDB, calcTags, makeFiles and writeOPML on the inputs in <tmp_dir>'
+      print '  (dblp_bht.xml, dblp.xml.gz, arXiv/), skipping stages whose inputs did not change'
+      print '  -i  incremental: makeDB only ingests records changed since its previous build'
+      print '  -j  number of processes per stage (default: 1)'
+      print '  -p  write a cProfile dump of every stage to the run directory (implies -j 1)'
+      print '  -f  run every stage'
+      print '  -r  where run directories go (default: <tmp_dir>/runs)'
+      print '  -z  publish compressed siblings of the files for static serving'
+
+   try:
+      opts, args = getopt.getopt(sys.argv[1:], 'ij:pfr:z')
+   except getopt.GetoptError:
+      usage()
+      sys.exit(1)
+   opts = dict(opts)
+   if len(args) < 2:
+      usage()
+      sys.exit(1)
+   paths = Paths(args[0], args[1])
+   runDir, report = run(paths, opts.get('-r', os.path.join(args[0], 'runs')),
+      int(opts.get('-j', 1)), '-p' in opts, '-f' in opts, '-z' in opts, '-i' in opts)
+   print_report(report)
+   print 'Run directory: %s' % runDir
+
+# vim:et:sw=3:ts=3
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012-2013 Lukasz Bolikowski
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from cStringIO import StringIO
+import gzip
+import os
+import os.path
+import sys
+
+try:
+   import brotli
+except ImportError:
+   # .br siblings are only written where the brotli module is installed
+   brotli = None
+
+SUFFIXES = ['.html', '.json', '.opml', '.part', '.xml']
+
+def gzip_data(data):
+   """Compresses data the way gzip -9n does: the output only depends on the
+   input, not on when or under which name it was compressed."""
+
+   buf = StringIO()
+   handle = gzip.GzipFile('', 'wb', 9, buf, 0)
+   handle.write(data)
+   handle.close()
+   return buf.getvalue()
+
+def encodings():
+   encodings = [('.gz', gzip_data)]
+   if brotli <> None:
+      encodings.append(('.br', brotli.compress))
+   return encodings
+
+def update(fileName):
+   """Writes the compressed siblings of a file (fileName.gz, and
+   fileName.br if possible), unless they are up to date.  Siblings get the
+   mtime of the file, so that they are up to date if and only if their mtime
+   matches.  Returns the number of siblings written."""
+
+   stat = os.stat(fileName)
+   data, written = None, 0
+   for suffix, compress in encodings():
+      target = fileName + suffix
+      # utime keeps microseconds at best
+      if os.path.exists(target) and abs(os.path.getmtime(target) - stat.st_mtime) < 1e-5:
+         continue
+      if data == None:
+         handle = open(fileName, 'rb')
+         data = handle.read()
+         handle.close()
+      handle = open(target + '.tmp', 'wb')
+      handle.write(compress(data))
+      handle.close()
+      os.utime(target + '.tmp', (stat.st_atime, stat.st_mtime))
+      os.rename(target + '.tmp', target)
+      written += 1
+   return written
+
+def update_tree(dirName):
+   """Brings the compressed siblings of every file with one of SUFFIXES
+   under dirName up to date, and removes those whose file is gone.  Returns
+   the number of siblings written and removed."""
+
+   suffixes = [suffix for suffix, _ in encodings()]
+   written, removed = 0, 0
+   for root, dirs, files in os.walk(dirName):
+      for name in files:
+         path = os.path.join(root, name)
+         base, extension = os.path.splitext(name)
+         if extension in ['.gz', '.br']:
+            if os.path.splitext(base)[1] in SUFFIXES and (extension not in suffixes or base not in files):
+               os.remove(path)
+               removed += 1
+         elif extension in SUFFIXES:
+            written += update(path)
+   return written, removed
+
+if __name__ == "__main__":
+   if len(sys.argv) < 2:
+      print 'Usage: %s <file_or_dir>...' % sys.argv[0]
+      print '  writes .gz%s siblings of the files, and of the %s files in the directories,' % (['', ' and .br'][brotli <> None], ', '.join(SUFFIXES))
+      print '  where they are missing or out of date'
+      sys.exit(1)
+   for name in sys.argv[1:]:
+      if os.path.isdir(name):
+         update_tree(name)
+      else:
+         update(name)
+
+# vim:et:sw=3:ts=3
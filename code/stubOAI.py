@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2012-2013 Lukasz Bolikowski
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met: 
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer. 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution. 
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import BaseHTTPServer
+import cgi
+import gzip
+import SocketServer
+import sys
+import urlparse
+from cStringIO import StringIO
+
+RECORDS = 100
+
+def make_page(name, page, pages):
+   """Renders a ListRecords page of synthetic arXiv records.  Every page but
+   the last carries a resumption token pointing at the next one."""
+
+   out = ['<?xml version="1.0" encoding="UTF-8"?>\n<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">\n<ListRecords>\n']
+   for i in xrange(page * RECORDS, (page + 1) * RECORDS):
+      out.append('<record><header><identifier>oai:arXiv.org:%s.%d</identifier></header><metadata>'
+         '<arXiv xmlns="http://arxiv.org/OAI/arXiv/"><id>%s.%d</id><title>On the complexity of %s problem %d</title>'
+         '<categories>cs.%s math.CO</categories></arXiv></metadata></record>\n' % (name, i, name, i, name, i, ['AI', 'DB', 'LG'][i % 3]))
+   if page + 1 < pages:
+      out.append('<resumptionToken cursor="%d">%s|%d</resumptionToken>\n' % (page * RECORDS, cgi.escape(name), page + 1))
+   else:
+      out.append('<resumptionToken cursor="%d"/>\n' % (page * RECORDS))
+   out.append('</ListRecords>\n</OAI-PMH>\n')
+   return ''.join(out)
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+   """Serves a fixed number of pages per harvest.  A harvest is named after
+   its from/until/set arguments, so disjoint windows get disjoint records.
+   Every busy-th request is turned away with 503 and Retry-After.  Pages are
+   gzipped if the client accepts it, and connections are kept alive."""
+
+   protocol_version = 'HTTP/1.1'
+
+   def do_GET(self):
+      server = self.server
+      server.requests += 1
+      if server.busy and server.requests % server.busy == 0:
+         self.send_response(503)
+         self.send_header('Retry-After', '1')
+         self.send_header('Content-Length', '0')
+         self.end_headers()
+         return
+
+      args = dict(urlparse.parse_qsl(urlparse.urlparse(self.path).query))
+      if 'resumptionToken' in args:
+         name, page = args['resumptionToken'].rsplit('|', 1)
+         page = int(page)
+      else:
+         name, page = '-'.join(args.get(key, '') for key in ['from', 'until', 'set']), 0
+      data = make_page(name, page, server.pages)
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/xml')
+      if 'gzip' in self.headers.get('Accept-Encoding', ''):
+         buf = StringIO()
+         handle = gzip.GzipFile(fileobj = buf, mode = 'wb')
+         handle.write(data)
+         handle.close()
+         data = buf.getvalue()
+         self.send_header('Content-Encoding', 'gzip')
+      self.send_header('Content-Length', str(len(data)))
+      self.end_headers()
+      self.wfile.write(data)
+
+   def log_message(self, format, *args):
+      pass
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+   daemon_threads = True
+
+   def __init__(self, address, pages, busy = 0):
+      BaseHTTPServer.HTTPServer.__init__(self, address, StubHandler)
+      self.pages = pages
+      self.busy = busy
+      self.requests = 0
+
+if __name__ == "__main__":
+   if len(sys.argv) < 3:
+      print 'Usage: %s <port> <pages> [<busy>]' % sys.argv[0]
+      print '  serves <pages> pages per harvest at http://localhost:<port>/oai2,'
+      print '  answering every <busy>-th request with 503 Retry-After'
+      sys.exit(1)
+   busy = 0
+   if len(sys.argv) > 3:
+      busy = int(sys.argv[3])
+   StubServer(('localhost', int(sys.argv[1])), int(sys.argv[2]), busy).serve_forever()
+
+# vim:et:sw=3:ts=3
@@ -33,13 +33,18 @@ DB=$TMP/dblp.sqlite
 DUMP=$TMP/dblp.xml.gz
 JSON=$TMP/index.json
 HTML=$TMP/index.html.part
+# read by the textfile collector of node_exporter
+METRICS=$TMP/metrics
 
-rm -rf $TMP/arXiv
-mkdir $TMP/arXiv
-$CODE/getOAI.py http://export.arxiv.org/oai2 'metadataPrefix=arXiv&set=cs' $TMP/arXiv/
-python $CODE/calcTags.py $DB $TMP/arXiv/
+mkdir -p $METRICS
+
+# kept between runs: each run only harvests what changed since the previous
+# one, and resumes it if it failed, so calcTags only parses the new chunks
+mkdir -p $TMP/arXiv
+$CODE/getOAI.py -i http://export.arxiv.org/oai2 'metadataPrefix=arXiv&set=cs' $TMP/arXiv/
+python $CODE/calcTags.py -m $METRICS/calcTags.prom $DB $TMP/arXiv/
 rm -rf $TMP/opml
 mkdir $TMP/opml
-python $CODE/writeOPML.py $DB $TMP/opml
+python $CODE/writeOPML.py -z $DB $TMP/opml
 rm -rf $WWW/opml
 mv $TMP/opml $WWW/opml
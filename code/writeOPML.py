@@ -25,50 +25,95 @@
 
 import cgi
 import datetime
+import getopt
+import itertools
 import json
 import re
 import sqlite3
 import sys
 
+import precompress
+
 LABELS = {'AI': 'Artificial Intelligence'}
 
-def write_opml(conn, opmlDirName):
-   by_tags = {}
-   for v, t in conn.execute('SELECT * FROM tags'):
-      by_tags[t] = by_tags.get(t, []) + [v]
+ALL = 'all'
 
-   for t in by_tags:
+def opml_feeds(conn):
+   """Returns (sanitized tag, label, venues) for every tag, where venues is
+   a list of (name, venue key) pairs ordered by name.  Venues and their
+   names come from a single join, grouped in one pass."""
+
+   rows = conn.execute('SELECT t.tag, v.name, v.key FROM tags AS t JOIN venue AS v ON v.key = t.venue WHERE v.name IS NOT NULL ORDER BY t.tag, v.name, v.key')
+   feeds = []
+   for t, group in itertools.groupby(rows, lambda row: row[0]):
       if not t.startswith('cs.'):
          raise Exception, 'Expecting only cs.* tags'
       sanitizedTag = re.sub('[^A-Z]', '', t)
       label = LABELS.get(sanitizedTag, sanitizedTag)
-      handle = open(opmlDirName + '/' + sanitizedTag + '.opml', 'w')
-      handle.write("""<?xml version="1.0" encoding="UTF-8"?>
+      feeds.append((sanitizedTag, label, [(name, v) for _, name, v in group]))
+   return feeds
+
+def escape(text):
+   return cgi.escape(text, True).encode('utf-8')
+
+def render_opml(title, outlines):
+   """Renders an OPML file with the given title, with a group of feeds for
+   every (label, venues) pair in outlines."""
+
+   out = ["""<?xml version="1.0" encoding="UTF-8"?>
 <opml version="1.0">
   <head>
-    <title>%s feeds</title>
+    <title>%s</title>
   </head>
-  <body>
-    <outline text="%s" title="%s">\n""" % (label, label, label))
-      for v in by_tags[t]:
-         name = conn.execute('SELECT name FROM venue WHERE key = ?', (v,)).fetchone()
-         if not name:
-            continue
-         name = name[0]
-         handle.write("""<outline type="rss" text="%s" title="%s" xmlUrl="http://services.ceon.pl/dblpfeeds/%s.xml" htmlUrl="http://dblp.uni-trier.de/db/%s/index.html"/>\n""" % (name, name, v, v))
-      handle.write("""    </outline>\n  </body>\n</opml>""")
-      handle.close()
+  <body>\n""" % escape(title)]
+   for label, venues in outlines:
+      out.append("""    <outline text="%s" title="%s">\n""" % (escape(label), escape(label)))
+      for name, v in venues:
+         out.append("""<outline type="rss" text="%s" title="%s" xmlUrl="http://services.ceon.pl/dblpfeeds/%s.xml" htmlUrl="http://dblp.uni-trier.de/db/%s/index.html"/>\n""" % (escape(name), escape(name), escape(v), escape(v)))
+      out.append("""    </outline>\n""")
+   out.append("""  </body>\n</opml>""")
+   return ''.join(out)
+
+def tag_opml(label, venues):
+   return render_opml(u'%s feeds' % label, [(label, venues)])
+
+def all_opml(feeds):
+   """Renders the OPML file of all tags, each as a group of its own."""
+
+   return render_opml(u'DBLP feeds by subject', [(label, venues) for _, label, venues in feeds])
+
+def write_file(fileName, data):
+   handle = open(fileName, 'w')
+   handle.write(data)
+   handle.close()
+
+def write_opml(conn, opmlDirName):
+   """Writes an OPML file for every tag, and all.opml with all of them (tags
+   are upper case, so it cannot clash with one)."""
+
+   feeds = opml_feeds(conn)
+   for sanitizedTag, label, venues in feeds:
+      write_file(opmlDirName + '/' + sanitizedTag + '.opml', tag_opml(label, venues))
+   write_file(opmlDirName + '/' + ALL + '.opml', all_opml(feeds))
 
 if __name__ == "__main__":
    def usage():
-      print 'Usage: %s <dblp.sqlite> <opml_dir>' % sys.argv[0]
+      print 'Usage: %s [-z] <dblp.sqlite> <opml_dir>' % sys.argv[0]
+      print '  -z  also write compressed siblings of the files, for static serving (see precompress.py)'
 
-   if len(sys.argv) < 3:
+   try:
+      opts, args = getopt.getopt(sys.argv[1:], 'z')
+   except getopt.GetoptError:
+      usage()
+      sys.exit(1)
+   if len(args) < 2:
       usage()
       sys.exit(1)
 
-   conn = sqlite3.connect(sys.argv[1])
-   write_opml(conn, sys.argv[2])
+   conn = sqlite3.connect(args[0])
+   write_opml(conn, args[1])
    conn.close()
+   if ('-z', '') in opts:
+      precompress.update_tree(args[1])
 
 # vim:et:sw=3:ts=3